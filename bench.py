@@ -0,0 +1,253 @@
+#benchmarks for the pinger, the correctness checks are in test_pinger.py
+#micro benchmarks for the per probe hot paths, end to end runs over simnet (no root needed)
+#and over loopback, and the startup time of a fresh process
+#the loopback and startup benchmarks open a raw socket, so run this as root (or with CAP_NET_RAW)
+#to get all of them, without it those are left out:
+#   sudo python bench.py --json results.json
+from socket import *
+import os
+import sys
+import time
+import subprocess
+import statistics
+import random
+import struct
+import timeit
+import itertools
+import pinger
+import simnet
+#the original checksum loop, timed next to the fast one
+from test_pinger import loopChecksum
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#what a cron launched CLI run does before its first probe goes out:
+#import the module, open the socket, send one echo request to loopback
+#it prints perf_counter at the moment the packet is sent, perf_counter is the system wide
+#monotonic clock on Linux and macOS so the parent can subtract its own start time from it
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import pinger
+imported = time.perf_counter()
+from socket import socket, AF_INET, SOCK_RAW, getprotobyname
+mySocket = socket(AF_INET, SOCK_RAW, getprotobyname("icmp"))
+pinger.sendOnePing(mySocket, "127.0.0.1", 1)
+sent = time.perf_counter()
+print(imported - start, sent - start, sent)
+"""
+
+
+#start a fresh interpreter runs times and time how long it takes until the first packet is sent
+#returns the medians in ms: importing pinger, import -> first packet, and process launch -> first packet
+#the script needs a raw socket, so without root (CAP_NET_RAW) there is nothing to measure
+def benchStartup(runs=20):
+    try:
+        socket(AF_INET, SOCK_RAW, getprotobyname("icmp")).close()
+    except PermissionError:
+        return {}
+    importTimes = []
+    firstPacketTimes = []
+    launchTimes = []
+    for i in range(runs):
+        launched = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=HERE,
+                                check=True, capture_output=True, text=True).stdout
+        imported, sent, sentAt = (float(x) for x in output.split())
+        importTimes.append(imported * 1000)
+        firstPacketTimes.append(sent * 1000)
+        launchTimes.append((sentAt - launched) * 1000)
+    return {"import_ms": statistics.median(importTimes),
+            "import_to_first_packet_ms": statistics.median(firstPacketTimes),
+            "launch_to_first_packet_ms": statistics.median(launchTimes)}
+
+
+#best of repeat runs of function, in microseconds per call
+def microseconds(function, number, repeat=3):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+#time the reference loop, checksum() and checksumUpdate() on packets of a few sizes, in microseconds per call
+def benchChecksum():
+    results = {}
+    for size in (16, 64, 512, 1472):
+        packet = os.urandom(size)
+        results[f"checksum_loop_{size}B_us"] = microseconds(lambda: loopChecksum(packet), 20000)
+        results[f"checksum_{size}B_us"] = microseconds(lambda: pinger.checksum(packet), 20000)
+    old, new = os.urandom(10), os.urandom(10)
+    results["checksum_update_10B_us"] = microseconds(lambda: pinger.checksumUpdate(0x1234, old, new), 100000)
+    return results
+
+
+#a socket that throws every packet away, so sending can be timed without the kernel
+class NullSocket:
+    type = SOCK_RAW
+
+    def sendto(self, packet, address):
+        return len(packet)
+
+    def getsockopt(self, level, option):
+        return 0
+
+
+#an echo reply to probe seq, with its IP header, the way a raw socket hands it over
+def echoReply(ID, seq):
+    icmp = struct.pack("!bbHHHQ", 0, 0, 0, ID, seq, time.perf_counter_ns())
+    return simnet.IP_HEADER.pack(0x45, 0, 20 + len(icmp), 0, 0, 64, 1, 0, inet_aton("10.0.0.1"),
+                                 inet_aton("127.0.0.1")) + icmp
+
+
+#the per probe work outside the checksum, in microseconds per call:
+#building a packet from scratch (what sendOnePing does) and reusing a PacketTemplate, parsing a reply,
+#the InFlightTable bookkeeping for one probe, and adding one RTT to the statistics
+def benchProbePath():
+    results = {}
+    nullSocket = NullSocket()
+    template = pinger.PacketTemplate("10.0.0.1", 0x1234)
+    results["packet_build_us"] = microseconds(lambda: pinger.PacketTemplate("10.0.0.1", 0x1234), 50000)
+    results["packet_fill_us"] = microseconds(lambda: template.fill(7, 1234567890123), 100000)
+    results["send_one_ping_us"] = microseconds(lambda: pinger.sendOnePing(nullSocket, "10.0.0.1", 0x1234, 7), 50000)
+    results["template_send_us"] = microseconds(lambda: template.send(nullSocket, 7), 100000)
+    #the same with instrumentation on, the difference is what metrics cost per probe sent
+    pinger.enableMetrics()
+    try:
+        results["template_send_metrics_us"] = microseconds(lambda: template.send(nullSocket, 7), 100000)
+    finally:
+        pinger.disableMetrics()
+
+    reader = pinger.ReplyReader()
+    reply = echoReply(0x1234, 7)
+    reader.buffer[:len(reply)] = reply
+    results["parse_reply_us"] = microseconds(lambda: pinger.parseReply(reply), 100000)
+    results["reader_parse_us"] = microseconds(reader.parse, 100000)
+
+    table = pinger.InFlightTable()
+    keys = itertools.count()
+
+    def addAndMatch():
+        key = (0x1234, next(keys) & 0xFFFF)
+        table.add(key, 0, 0, 0, time.monotonic() + 1)
+        table.match(key)
+    results["in_flight_add_match_us"] = microseconds(addAndMatch, 20000)
+
+    stats = pinger.PingStats()
+    rtts = itertools.cycle([random.Random(4).lognormvariate(0, 1) for _ in range(1000)])
+    results["ping_stats_add_us"] = microseconds(lambda: stats.add(next(rtts)), 100000)
+    histogram = pinger.LatencyHistogram()
+    results["histogram_add_us"] = microseconds(lambda: histogram.add(next(rtts)), 100000)
+    results["histogram_percentiles_us"] = microseconds(histogram.percentiles, 200)
+    other = pinger.PingStats()
+    for i in range(1000):
+        other.add(next(rtts))
+    results["ping_stats_merge_us"] = microseconds(lambda: pinger.PingStats().merge(other), 200)
+    return results
+
+
+#run function once and report probes per second and the CPU the calling thread spent per probe
+#thread_time leaves out the simulated network's delivery threads, so only the pinger's own work is counted
+def throughput(name, probes, function):
+    wall, cpu = time.perf_counter(), time.thread_time()
+    function()
+    wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+    return {f"{name}_probes_per_s": probes / wall, f"{name}_cpu_us_per_probe": cpu / probes * 1e6}
+
+
+#end to end over simnet, no root needed: ping_many and monitor over hosts simulated hosts, a /16 sweep,
+#how much the pinger adds to a fixed 1ms RTT (median measured RTT - 1ms, in microseconds) and how many packets
+#ping_many reads per wakeup on average
+def benchSimulated(hosts=10000):
+    results = {}
+    addresses = [f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}" for i in range(1, hosts + 1)]
+    network = simnet.SimulatedNetwork(default=simnet.SimulatedHost(0.001), queueLimit=10 ** 6)
+    counters = pinger.ReceiveCounters()
+    results.update(throughput("sim_ping_many", hosts * 3, lambda: pinger.ping_many(
+        addresses, count=3, interval=0.2, timeout=1, counters=counters, mode=network)))
+    results["sim_ping_many_packets_per_wakeup"] = counters.wakeups / max(1, counters.batches)
+    results.update(throughput("sim_monitor", hosts * 3, lambda: pinger.monitor(
+        addresses, interval=0.2, count=3, rate=10 ** 6, timeout=1, onReport=None, mode=network)))
+    results.update(throughput("sim_sweep", 65534, lambda: sum(1 for reply in pinger.sweep(
+        ["10.200.0.0/16"], rate=10 ** 6, timeout=0.5, mode=network))))
+
+    single = pinger.ping_many(["10.0.0.1"], count=200, interval=0.002, timeout=1, mode=network)
+    rtts = [result.rtt for result in single["10.0.0.1"] if result.status == pinger.Status.REPLY]
+    results["sim_rtt_overhead_us"] = (statistics.median(rtts) - 1.0) * 1000
+    return results
+
+
+#end to end over loopback with a real raw socket, {} if we aren't allowed to open one
+#the replies come from the kernel, so the measured RTT is almost all our own overhead plus the kernel's
+def benchLoopback(hosts=200):
+    try:
+        socket(AF_INET, SOCK_RAW, getprotobyname("icmp")).close()
+    except PermissionError:
+        return {}
+    results = {}
+    addresses = [f"127.0.{i // 250}.{i % 250 + 1}" for i in range(hosts)]
+    results.update(throughput("loopback_ping_many", hosts * 5, lambda: pinger.ping_many(
+        addresses, count=5, interval=0.05, timeout=1, kernelFilter=True)))
+    rtts = []
+    for i in range(200):
+        result = pinger.doOnePing("127.0.0.1", 1)
+        if result.status == pinger.Status.REPLY:
+            rtts.append(result.rtt)
+    results["loopback_rtt_us"] = statistics.median(rtts) * 1000
+    return results
+
+
+#run every benchmark and return one flat dict name -> number
+def runBenchmarks(startup=True, loopback=True, hosts=10000):
+    results = {}
+    results.update(benchChecksum())
+    results.update(benchProbePath())
+    results.update(benchSimulated(hosts))
+    if loopback:
+        results.update(benchLoopback())
+    if startup:
+        results.update(benchStartup())
+    return results
+
+
+#the current commit, so result files from different versions can be told apart
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#python bench.py [--json results.json] [--compare old.json]
+#runs every benchmark, prints them and optionally writes them as JSON
+#with --compare every number is shown next to the one in an earlier results file, with the change in percent
+#(for _us numbers lower is better, for _per_s higher is)
+if __name__ == '__main__':
+    import argparse
+    import json
+    import platform
+    parser = argparse.ArgumentParser(description="pinger benchmarks")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="show the change against an earlier results file")
+    parser.add_argument("--hosts", type=int, default=10000, help="simulated hosts for the end to end runs")
+    parser.add_argument("--no-startup", action="store_true", help="skip the process startup benchmark")
+    parser.add_argument("--no-loopback", action="store_true", help="skip the raw socket loopback benchmark")
+    args = parser.parse_args()
+
+    results = runBenchmarks(not args.no_startup, not args.no_loopback, args.hosts)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as compareFile:
+            previous = json.load(compareFile)["results"]
+    for name, value in results.items():
+        line = f"{name:36} {value:14.2f}"
+        if previous.get(name):
+            line += f" {previous[name]:14.2f} {(value - previous[name]) / previous[name] * 100:+8.1f}%"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as jsonFile:
+            json.dump({"revision": gitRevision(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                       "results": results}, jsonFile, indent=2)
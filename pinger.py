@@ -5,35 +5,59 @@ import struct
 import time
 import select
 import binascii
-import pandas as pd
-import warnings
-warnings.simplefilter(action='ignore', category=FutureWarning)
+import array
+import math
 from socket import gethostbyaddr
+from enum import IntEnum
 
 #8 is the value of the ICMP echo message request used in ping
 ICMP_ECHO_REQUEST = 8
+#what routers send back when a probe's TTL runs out, or when they can't deliver it
+ICMP_TIME_EXCEEDED = 11
+ICMP_DEST_UNREACHABLE = 3
+
+#precompiled layouts for the hot path
+#everything is in network byte order (!) so the id and sequence on the wire are the numbers we think they are,
+#which the kernel BPF filter needs since it always reads packets as big endian
+#the ICMP header (type, code, checksum, id, sequence)
+ICMP_HEADER = struct.Struct("!bbHHH")
+#the sequence number and the timestamp in the payload, the timestamp is an integer number of nanoseconds
+SEQ_AND_TIME = struct.Struct("!HQ")
+#the checksum field, checksum() returns it in network byte order
+CHECKSUM_FIELD = struct.Struct("!H")
+#the sequence number and timestamp read back as the five 16 bit words the checksum sees
+SEQ_AND_TIME_WORDS = struct.Struct("!5H")
+TIMESTAMP = struct.Struct("!Q")
+#struct timespec (seconds, nanoseconds) as the kernel hands it over with SO_TIMESTAMPNS
+TIMESPEC = struct.Struct("ll")
+
+#Linux socket option for attaching a classic BPF program, not every Python build has the constant
+SO_ATTACH_FILTER = 26
+#Linux socket option asking for the TTL of every received packet as ancillary data, same story
+IP_RECVTTL = 12
+#Linux socket option asking for the kernel receive time of every packet as ancillary data (a timespec)
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+#Linux socket option setting the receive buffer past net.core.rmem_max, needs CAP_NET_ADMIN
+SO_RCVBUFFORCE = 33
+#most packets the batch receive loops read in one go before they look at the clock again
+RECEIVE_BATCH = 1024
 
 #calculate checksum of input string which is used to ensure
 #the integrity of the ICMP message
 #
+#instead of looping 2 bytes at a time we let array read the whole string as 16 bit words
+#and sum them in C, the result is exactly the same as the old loop (bench.py checks it)
 def checksum(string):
-    csum = 0
-    # initialize to the largest even number less than or equal to the string
-    countTo = (len(string) // 2) * 2
-    count = 0
-    #loop through the string, take in 2 bytes at a time
-    #combine them into a 16 bit value
-    #and add it to the current csum
-    #and ensure csum stayes within 32 bits
-    while count < countTo:
-        thisVal = (string[count + 1]) * 256 + (string[count])
-        csum += thisVal
-        csum &= 0xffffffff
-        count += 2
-    # if the string length is odd, add the last byte to csum and ensure it stays within 32 bits
-    if countTo < len(string):
-        csum += (string[len(string) - 1])
-        csum &= 0xffffffff
+    # pad an odd length string with a zero byte, the last byte then counts as the low byte of a word like before
+    if len(string) % 2:
+        string = bytes(string) + b"\0"
+    # read the string as little endian 16 bit words, same as string[count + 1] * 256 + string[count]
+    words = array.array("H", bytes(string))
+    if sys.byteorder == "big":
+        words.byteswap()
+    # the old loop kept csum within 32 bits at every step, which is the same as doing it once at the end
+    csum = sum(words) & 0xffffffff
     # fold csum into 16 bits by adding the upper 16 bits to the lower 16 bits
     # take the one's compliment of the 16 bit csum and swap its bytes to get the final checksum value
     csum = (csum >> 16) + (csum & 0xffff)
@@ -44,178 +68,2078 @@ def checksum(string):
     return answer
 
 
+#update a checksum from checksum() after some bytes of the packet changed, without summing the whole packet again
+#this is the incremental update from RFC 1624: HC' = ~(~HC + ~m + m') for every changed 16 bit word m -> m'
+#oldData and newData are the old and new bytes of the changed field, same even length,
+#and the field has to start at an even offset in the packet (the sequence number and our timestamp both do)
+def checksumUpdate(oldChecksum, oldData, newData):
+    words = len(oldData) // 2
+    old = struct.unpack(f"!{words}H", oldData)
+    new = struct.unpack(f"!{words}H", newData)
+    # ~m is 0xffff - m for 16 bit words, so all the ~m add up to 0xffff * words - sum(old)
+    csum = (~oldChecksum & 0xffff) + 0xffff * words - sum(old) + sum(new)
+    while csum >> 16:
+        csum = (csum >> 16) + (csum & 0xffff)
+    return ~csum & 0xffff
+
+
 
 #we keep waiting till we get a message or run out of time after pinging the server first
 #recieve ICMP response from the server
-def receiveOnePing(mySocket, ID, timeout, destAddr):
-    #set time left to the input timeout
-    timeLeft = timeout
+#the timeout bookkeeping uses the monotonic clock so a wall clock jump can't cut it short or stretch it
+#with seq only the reply to that sequence number counts, and with an InFlightTable as well the probe
+#(ID, seq) is timed out in the table when we give up on it, so its reply turning up during the next probe
+#is counted as late there instead of being taken for the next probe's answer. duplicates and late replies
+#to earlier probes are recorded in the table and we keep waiting
+#returns a PingResult, a reply or a timeout (destAddr is only kept so older callers still work)
+def receiveOnePing(mySocket, ID, timeout, destAddr, table=None, seq=None):
+    #work out when we give up, so the time spent on packets that aren't ours doesn't need adding up
+    deadline = time.monotonic() + timeout
+    clock = socketClock(mySocket)
+    reader = ReplyReader(dgram=mySocket.type == SOCK_DGRAM, timestamps=clock is time.time_ns)
 
     #enter a loop until there's a response or the timeout is reached
     while 1:
-        #record the starttime of the select function
-        startedSelect = time.time()
+        #check if the time is up, the packets we read since the last select could have taken the rest of it
+        startedSelect = time.monotonic()
+        timeLeft = deadline - startedSelect
+        if timeLeft <= 0:
+            break
         #use select to wait for a response from the socket or a timeout
         whatReady = select.select([mySocket], [], [], timeLeft)
-        #calculate the time spent in the select function
-        howLongInSelect = (time.time() - startedSelect)
+        if metrics is not None:
+            metrics.observe("select", (time.monotonic() - startedSelect) * 1000)
         #check if the socket is empty which means a timeout occurred
-        #and return timeout
         if whatReady[0] == []:  # Timeout
-            return "Request timed out."
-        #record the time the response was recieved
-        timeReceived = time.time()
-        #recieve the ICMP packet and source address
-        recPacket, addr = mySocket.recvfrom(1024)
+            break
 
-        #extract the ICMP header from the IP packet
-        # Fill in start##################################################################
-        # Fill in start
-        icmp_header = recPacket[20:28]
-        icmp_type, icmp_code, icmp_checksum, icmp_id, icmp_seq = struct.unpack("bbHHh", icmp_header)
-        if icmp_type != 0 or icmp_id != ID:
-            continue
+        #read what is queued before going back to select, a raw socket gets every ICMP packet the host
+        #receives, so when it is busy that is one select per burst instead of one per packet
+        #at most RECEIVE_BATCH packets and never past the deadline, so a flood can't keep us here
+        for read in range(RECEIVE_BATCH):
+            if time.monotonic() >= deadline:
+                break
+            if metrics is not None:
+                parseStarted = time.perf_counter_ns()
+            #recieve the ICMP packet and source address straight into our buffer
+            try:
+                nbytes, addr = reader.receive(mySocket, MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            #record the time the response was recieved, the kernel's if we asked for it
+            timeReceived = reader.received or clock()
 
-        payload = struct.unpack("d", recPacket[28:])[0]
-        rtt = (timeReceived - payload) * 1000
-        ttl = struct.unpack("B", recPacket[8:9])[0]
+            #extract the ICMP header from the IP packet
+            icmp_type, icmp_id, icmp_seq, ttl = reader.parse()
+            status = Status.UNKNOWN
+            if icmp_type == 0 and icmp_id == ID:
+                status = Status.REPLY if table is None else table.match((icmp_id, icmp_seq))[0]
+            if metrics is not None:
+                metrics.since("parse", parseStarted)
+                metrics.count(PACKET_COUNTERS[status])
+            if status == Status.REPLY and (seq is None or icmp_seq == seq):
+                payload = TIMESTAMP.unpack_from(reader.buffer, nbytes - 8)[0]
+                return PingResult(Status.REPLY, (timeReceived - payload) / 1e6, ttl, nbytes)
 
-        return f"Reply from {destAddr}: bytes={len(recPacket)} time={rtt:.2f}ms TTL={ttl}", {"bytes": len(recPacket), "rtt": rtt, "ttl": ttl}
-        # Fill in end
+    #out of time, and return timeout
+    if table is not None and seq is not None:
+        table.timeout((ID, seq))
+    if metrics is not None:
+        metrics.count("timeouts")
+    return PingResult(Status.TIMEOUT)
 
 
-        # Fill in end####################################################################
 
-        #update timeleft and check if it's less than or equal to 0, indicating timeout
-        timeLeft = timeLeft - howLongInSelect
-        if timeLeft <= 0:
-            return "Request timed out."
 
+#a ready made echo request for one destination that we reuse for every probe we send it
+#the header and payload are packed once into a bytearray, then for every probe only the sequence number
+#and timestamp are written in place with pack_into and the checksum is patched, nothing new gets built
+class PacketTemplate:
+    __slots__ = ("packet", "address", "baseChecksum")
+
+    def __init__(self, destAddr, ID):
+        # Header is type (8), code (8), checksum (16), id (16), sequence (16), then our 8 byte timestamp
+        self.packet = bytearray(ICMP_HEADER.size + TIMESTAMP.size)
+        ICMP_HEADER.pack_into(self.packet, 0, ICMP_ECHO_REQUEST, 0, 0, ID, 0)
+        #sendto wants the address as a tuple (ip, port), keep it so we don't build it per probe
+        self.address = (destAddr, 1)
+        #checksum of the packet while the sequence number and timestamp are still zero
+        self.baseChecksum = checksum(self.packet)
+
+    #write the sequence number and timestamp into the packet and fix up the checksum
+    #this is the RFC 1624 update from checksumUpdate(), the old words are all zero so the ~m terms drop out
+    #and we only add the new words to the checksum of the zeroed template
+    def fill(self, seq, timestamp):
+        packet = self.packet
+        SEQ_AND_TIME.pack_into(packet, 6, seq, timestamp)
+        csum = (~self.baseChecksum & 0xffff) + sum(SEQ_AND_TIME_WORDS.unpack_from(packet, 6))
+        csum = (csum >> 16) + (csum & 0xffff)
+        csum = csum + (csum >> 16)
+        CHECKSUM_FIELD.pack_into(packet, 2, ~csum & 0xffff)
+        return packet
+
+    #stamp the packet with the current time in ns from clock and send it
+    #returns the timestamp, which is as close to the real send time as we can get
+    def send(self, mySocket, seq, clock=time.perf_counter_ns):
+        if metrics is not None:
+            return self.sendMeasured(mySocket, seq, clock)
+        sent = clock()
+        mySocket.sendto(self.fill(seq, sent), self.address)
+        return sent
+
+    #send() with the checksum and send stages timed, only used while metrics are on
+    def sendMeasured(self, mySocket, seq, clock):
+        sent = clock()
+        started = time.perf_counter_ns()
+        packet = self.fill(seq, sent)
+        metrics.since("checksum", started)
+        started = time.perf_counter_ns()
+        try:
+            mySocket.sendto(packet, self.address)
+        except OSError:
+            metrics.count("send_errors")
+            raise
+        metrics.since("send", started)
+        metrics.count("probes_sent")
+        return sent
+
+
+#one receive buffer that is reused for every reply, recvfrom_into writes into it
+#instead of recvfrom allocating a new 1024 byte string per packet, the parsing reads it with unpack_from
+#a dgram ping socket gives us the ICMP message without the IP header, so the TTL has to come
+#from the IP_RECVTTL ancillary data instead, which means recvmsg_into instead of recvfrom_into
+#with timestamps the socket has SO_TIMESTAMPNS on and received is the kernel's receive time in ns
+#(CLOCK_REALTIME, so compare it with time.time_ns()), it is 0 when there isn't one
+class ReplyReader:
+    __slots__ = ("buffer", "dgram", "timestamps", "ttl", "received", "ancillarySize")
+
+    def __init__(self, size=1024, dgram=False, timestamps=False):
+        self.buffer = bytearray(size)
+        self.dgram = dgram
+        self.timestamps = timestamps
+        self.ttl = 0
+        self.received = 0
+        self.ancillarySize = CMSG_SPACE(4) + CMSG_SPACE(TIMESPEC.size)
+
+    #returns (number of bytes received, source address), flags go to the recv call (MSG_DONTWAIT)
+    def receive(self, mySocket, flags=0):
+        if not self.dgram and not self.timestamps:
+            return mySocket.recvfrom_into(self.buffer, 0, flags)
+        nbytes, ancdata, msgFlags, addr = mySocket.recvmsg_into([self.buffer], self.ancillarySize, flags)
+        self.ttl = 0
+        self.received = 0
+        for level, kind, data in ancdata:
+            if level == IPPROTO_IP and kind == IP_TTL:
+                self.ttl = int.from_bytes(data[:4], sys.byteorder)
+            elif level == SOL_SOCKET and kind == SCM_TIMESTAMPNS:
+                seconds, nanoseconds = TIMESPEC.unpack_from(data)
+                self.received = seconds * 1000000000 + nanoseconds
+        return nbytes, addr
+
+    #(icmp type, id, sequence, TTL) of the packet in the buffer
+    def parse(self):
+        if not self.dgram:
+            return parseReply(self.buffer)
+        icmp_type, icmp_code, icmp_checksum, icmp_id, icmp_seq = ICMP_HEADER.unpack_from(self.buffer, 0)
+        return icmp_type, icmp_id, icmp_seq, self.ttl
+
+
+#pull the fields we need out of a raw reply packet, works on bytes or on the ReplyReader buffer
+#the IP header length is in the low 4 bits of the first byte (in 32 bit words) so we don't assume 20 bytes
+#the TTL is byte 8 of the IP header
+def parseReply(recPacket):
+    ipHeaderLen = (recPacket[0] & 0x0F) * 4
+    icmp_type, icmp_code, icmp_checksum, icmp_id, icmp_seq = ICMP_HEADER.unpack_from(recPacket, ipHeaderLen)
+    return icmp_type, icmp_id, icmp_seq, recPacket[8]
+
+
+#ask the kernel to timestamp every packet it receives on this socket (SO_TIMESTAMPNS)
+#the RTT then doesn't include the time it took us to wake up from select and get to the packet,
+#which on a loaded box can be much more than the RTT itself
+def enableKernelTimestamps(mySocket):
+    mySocket.setsockopt(SOL_SOCKET, SO_TIMESTAMPNS, 1)
+
+
+#the clock probes on this socket are timed with, as a function returning ns
+#normally the monotonic perf_counter_ns, which wall clock changes (NTP, DST...) can't affect
+#kernel timestamps are CLOCK_REALTIME though, so with those the send side has to use time_ns to match
+def socketClock(mySocket):
+    if mySocket.getsockopt(SOL_SOCKET, SO_TIMESTAMPNS):
+        return time.time_ns
+    return time.perf_counter_ns
+
+
+#ask for a receive buffer of size bytes, so a burst of replies (a big sweep, thousands of hosts answering
+#the same round) waits in the kernel instead of being dropped while we are busy sending
+#SO_RCVBUF is capped at net.core.rmem_max, as root SO_RCVBUFFORCE goes past that
+#returns the size the kernel gave the socket (it doubles what we ask for, for its own bookkeeping)
+#or None for a socket that doesn't have one, like a simulated one
+def setReceiveBuffer(mySocket, size):
+    try:
+        mySocket.setsockopt(SOL_SOCKET, SO_RCVBUFFORCE, size)
+    except OSError:
+        try:
+            mySocket.setsockopt(SOL_SOCKET, SO_RCVBUF, size)
+        except OSError:
+            return None
+    return mySocket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+
+
+#an epoll object watching a socket for packets to read, level triggered, so whatever a receive loop
+#leaves in the socket (it stopped at RECEIVE_BATCH) wakes the next poll straight away
+def socketPoller(mySocket):
+    poller = select.epoll()
+    poller.register(mySocket.fileno(), select.EPOLLIN)
+    return poller
+
+
+#read everything queued on a non-blocking socket, until it would block or limit packets were read
+#and keep the echo replies: returns (packets read, list of ((id, sequence), source address,
+#receive time from clock, bytes, TTL)), the caller then matches the whole list against its InFlightTable
+def drainReplies(mySocket, reader, clock, limit=RECEIVE_BATCH):
+    replies = []
+    read = 0
+    while read < limit:
+        try:
+            nbytes, addr = reader.receive(mySocket)
+        except (BlockingIOError, InterruptedError):
+            break
+        read += 1
+        timeReceived = reader.received or clock()
+        icmp_type, icmp_id, icmp_seq, ttl = reader.parse()
+        if icmp_type == 0:
+            replies.append(((icmp_id, icmp_seq), addr[0], timeReceived, nbytes, ttl))
+    return read, replies
+
+
+#build a classic BPF program that only lets ICMP echo replies with an id in lowID..highID through
+#a raw socket gets a copy of every ICMP packet the host receives, with this attached the kernel drops
+#everything else before it wakes us up. if highID < lowID the range wraps around 0xFFFF
+#the socket sees the IP header first, so we find the ICMP header with the IP header length
+def echoReplyFilter(lowID, highID):
+    wraps = highID < lowID
+    program = [
+        (0xb1, 0, 0, 0),                                   # ldxb 4*([0]&0xf)   x = IP header length
+        (0x50, 0, 0, 0),                                   # ldb [x+0]          ICMP type
+        (0x15, 0, 4, 0),                                   # jeq #0 (echo reply) else drop
+        (0x48, 0, 0, 4),                                   # ldh [x+4]          ICMP id
+        (0x35, 1, 0, lowID) if wraps else (0x35, 0, 2, lowID),  # jge #lowID
+        (0x25, 1, 0, highID),                              # jgt #highID -> drop
+        (0x06, 0, 0, 0x40000),                             # ret #0x40000       accept
+        (0x06, 0, 0, 0),                                   # ret #0             drop
+    ]
+    return b"".join(struct.pack("HBBI", *instruction) for instruction in program)
+
+
+#attach echoReplyFilter(lowID, highID) to the socket with SO_ATTACH_FILTER (Linux only)
+#setsockopt wants a struct sock_fprog which holds a pointer to the instructions, so we need ctypes for the address
+#the kernel copies the program during the call, the buffer doesn't have to outlive it
+#call it before sending anything: whatever got queued between opening the socket and attaching the filter
+#got past it, so that is thrown away (with several pingers on one host that is other processes' replies)
+def attachReplyFilter(mySocket, lowID, highID):
+    import ctypes
+    program = echoReplyFilter(lowID, highID)
+    buffer = ctypes.create_string_buffer(program)
+    fprog = struct.pack("HP", len(program) // 8, ctypes.addressof(buffer))
+    mySocket.setsockopt(SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    try:
+        while True:
+            mySocket.recv(1, MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        pass
+
+
+#how many ICMP messages the host has received so far, from /proc/net/snmp (Linux only)
+#a raw ICMP socket without a filter would have been woken up for every one of them
+def icmpInMessages():
+    with open("/proc/net/snmp") as snmp:
+        lines = [line.split() for line in snmp if line.startswith("Icmp:")]
+    return int(lines[1][lines[0].index("InMsgs")])
+
+
+#counts what the receive loop was woken up for, pass one to ping_many to have it filled in
+#wakeups: packets that reached us, batches: how many times the loop woke up and drained the socket
+#(so wakeups / batches is the average batch), foreign: the ones that weren't replies to our probes,
+#kernelDropped: ICMP messages the host received during the run that never woke us up,
+#which with the BPF filter on is the number of wakeups it saved (estimated from /proc/net/snmp,
+#so other traffic on the host is counted too, which is exactly what the filter is for)
+#duplicates, late and reordered come from the InFlightTable, see there
+class ReceiveCounters:
+    __slots__ = ("wakeups", "batches", "foreign", "kernelDropped", "duplicates", "late", "reordered")
+
+    def __init__(self):
+        self.wakeups = 0
+        self.batches = 0
+        self.foreign = 0
+        self.kernelDropped = 0
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+
+
+#optional instrumentation of the hot path: counters and a timing histogram per stage
+#off by default, then every instrumented spot costs one check of the module global metrics being None
+#enableMetrics() switches it on for the whole process and returns the Metrics being collected
+#stages (timed in ms): socket (opening it), checksum (filling in the packet), send (the sendto call),
+#select (waiting for a packet), parse (reading a packet and working out what it is),
+#stats (adding an RTT to PingStats) and dataframe (building the pandas DataFrame)
+#counters: probes_sent, send_errors, replies, foreign_packets, timeouts, late_replies, duplicate_replies
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        #stage -> LatencyHistogram of its times in ms, and the total time per stage for the Prometheus sum
+        self.timings = {}
+        self.totals = {}
+        self.hooks = []
+
+    #call hook(name, value) for everything recorded from now on, value is the count for a counter
+    #and the time in ms for a stage. hooks run inline on the hot path so they should be quick
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        for hook in self.hooks:
+            hook(name, n)
+
+    #record that stage took ms milliseconds
+    def observe(self, stage, ms):
+        histogram = self.timings.get(stage)
+        if histogram is None:
+            histogram = self.timings[stage] = LatencyHistogram(lowest=0.00001)
+            self.totals[stage] = 0.0
+        histogram.add(ms)
+        self.totals[stage] += ms
+        for hook in self.hooks:
+            hook(stage, ms)
+
+    #record the time since started (a time.perf_counter_ns()) for stage
+    def since(self, stage, started):
+        self.observe(stage, (time.perf_counter_ns() - started) / 1e6)
+
+    #everything in the Prometheus text format, the counters as pinger_<name>_total and the stages as
+    #one summary pinger_stage_seconds with a stage label
+    def prometheus(self):
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE pinger_{name}_total counter")
+            lines.append(f"pinger_{name}_total {value}")
+        if self.timings:
+            lines.append("# TYPE pinger_stage_seconds summary")
+        for stage, histogram in sorted(self.timings.items()):
+            for p, ms in histogram.percentiles().items():
+                lines.append(f'pinger_stage_seconds{{stage="{stage}",quantile="{p / 100:g}"}} {ms / 1000:.9f}')
+            lines.append(f'pinger_stage_seconds_sum{{stage="{stage}"}} {self.totals[stage] / 1000:.9f}')
+            lines.append(f'pinger_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+#the Metrics being collected, None while instrumentation is off
+metrics = None
+
+
+#switch instrumentation on (or keep the Metrics already collecting) and return it
+def enableMetrics():
+    global metrics
+    if metrics is None:
+        metrics = Metrics()
+    return metrics
+
+
+def disableMetrics():
+    global metrics
+    metrics = None
+
+
+#serve the metrics for Prometheus to scrape on http://address:port/metrics from a background thread
+#returns the server, call shutdown() on it to stop
+def serveMetrics(port=9464, address=""):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = (metrics.prometheus() if metrics is not None else "").encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics server", daemon=True).start()
+    return server
+
+
+#hashed timer wheel for probe timeouts
+#time is cut into ticks of tick seconds and the wheel has size slots, a timer goes into slot (its tick % size)
+#every tick we only look at one slot, so keeping track of 100k outstanding probes costs O(1) per tick
+#instead of a select timeout (or a sorted structure) per probe. timers further away than one turn of the wheel
+#share a slot with nearer ones and just stay there until their tick comes around
+class TimerWheel:
+    __slots__ = ("tick", "slots", "current")
+
+    def __init__(self, tick=0.01, size=1024, now=None):
+        self.tick = tick
+        self.slots = [[] for _ in range(size)]
+        #the last tick we processed
+        self.current = int((time.monotonic() if now is None else now) / tick)
+
+    #fire item at deadline (time.monotonic() seconds), never before it
+    def schedule(self, item, deadline):
+        due = max(math.ceil(deadline / self.tick), self.current + 1)
+        self.slots[due % len(self.slots)].append((due, item))
+
+    #move the wheel up to now and return the items that are due
+    #if we fell behind by more than a whole turn every slot is looked at once, not once per missed tick
+    def advance(self, now):
+        target = int(now / self.tick)
+        size = len(self.slots)
+        due = []
+        for step in range(min(target - self.current, size)):
+            slot = self.slots[(self.current + 1 + step) % size]
+            if not slot:
+                continue
+            waiting = []
+            for entry in slot:
+                (due if entry[0] <= target else waiting).append(entry)
+            slot[:] = waiting
+        self.current = max(self.current, target)
+        return [entry[1] for entry in due]
+
+    #when the next tick starts, i.e. the latest time advance() has to be called for timers to fire on time
+    def nextTick(self):
+        return (self.current + 1) * self.tick
+
+
+#one outstanding (or recently finished) probe in an InFlightTable
+#sentAt is the wall clock time it went out in ns since the epoch, for callers that log it (None otherwise),
+#sent is on the socket's clock which isn't the wall clock unless the kernel timestamps are on
+class Probe:
+    __slots__ = ("host", "round", "sent", "answered", "sentAt")
+
+    def __init__(self, host, round, sent):
+        self.host = host
+        self.round = round
+        self.sent = sent
+        self.answered = False
+        self.sentAt = None
 
 
+#what happened to a probe, and what InFlightTable.match says about a reply
+#the values are what the status column of a BatchResults and of a result log holds
+class Status(IntEnum):
+    REPLY = 0       # answered, or for a reply: the answer to a probe that is still waiting
+    TIMEOUT = 1     # no answer in time
+    LATE = 2        # the answer to a probe that already timed out
+    DUPLICATE = 3   # a second answer to a probe that was already answered
+    UNKNOWN = 4     # not one of our probes, or one we finished with too long ago
+    SEND_ERROR = 5  # never went out: the send failed or the host didn't resolve
+
+
+#the Metrics counter for each kind of reply
+PACKET_COUNTERS = {Status.REPLY: "replies", Status.DUPLICATE: "duplicate_replies", Status.LATE: "late_replies",
+                   Status.UNKNOWN: "foreign_packets"}
+
+
+#the result of one probe: status is a Status, rtt in ms (NaN unless it was answered),
+#ttl and bytes of the reply (0 unless it was answered)
+class PingResult:
+    __slots__ = ("status", "rtt", "ttl", "bytes")
+
+    def __init__(self, status, rtt=math.nan, ttl=0, bytes=0):
+        self.status = status
+        self.rtt = rtt
+        self.ttl = ttl
+        self.bytes = bytes
+
+    def __repr__(self):
+        return f"PingResult({self.status.name}, rtt={self.rtt}, ttl={self.ttl}, bytes={self.bytes})"
+
+    @property
+    def ok(self):
+        return self.status == Status.REPLY
+
+
+#the line the command line prints for one probe
+def formatResult(result, destAddr):
+    if result.status == Status.REPLY:
+        return f"Reply from {destAddr}: bytes={result.bytes} time={result.rtt:.2f}ms TTL={result.ttl}"
+    if result.status == Status.SEND_ERROR:
+        return "Send failed."
+    return "Request timed out."
+
+#the probes we are waiting for, keyed by (ICMP id, sequence)
+#answered and timed out probes are kept for linger seconds so replies that still show up for them
+#can be told apart: a duplicate, a late reply, or something that was never ours
+#reordered counts replies that came in after a reply to a later probe (a higher round) of the same host
+#timeouts and forgetting finished probes both run off one TimerWheel
+class InFlightTable:
+    def __init__(self, linger=10.0, tick=0.01, size=1024):
+        self.probes = {}
+        self.finished = {}
+        self.wheel = TimerWheel(tick, size)
+        self.linger = linger
+        #host -> highest round answered so far
+        self.lastRound = {}
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+
+    def __len__(self):
+        return len(self.probes)
+
+    #start waiting for the reply to a probe, deadline is in time.monotonic() seconds
+    def add(self, key, host, round, sent, deadline):
+        probe = Probe(host, round, sent)
+        self.probes[key] = probe
+        self.wheel.schedule((key, probe, False), deadline)
+        return probe
+
+    #the probe waiting (or recently finished) under key, without changing anything
+    def get(self, key):
+        probe = self.probes.get(key)
+        return probe if probe is not None else self.finished.get(key)
+
+    #a reply came in for key, returns (Status.REPLY/DUPLICATE/LATE/UNKNOWN, the Probe or None)
+    def match(self, key):
+        probe = self.probes.pop(key, None)
+        if probe is not None:
+            probe.answered = True
+            self.finish(key, probe)
+            if probe.round < self.lastRound.get(probe.host, -1):
+                self.reordered += 1
+            else:
+                self.lastRound[probe.host] = probe.round
+            return Status.REPLY, probe
+        probe = self.finished.get(key)
+        if probe is None:
+            return Status.UNKNOWN, None
+        if probe.answered:
+            self.duplicates += 1
+            return Status.DUPLICATE, probe
+        #a copy of this late reply showing up again is a duplicate
+        probe.answered = True
+        self.late += 1
+        return Status.LATE, probe
+
+    #match for a whole batch of replies, in order, returns a list of (Status, Probe or None)
+    def matchAll(self, keys):
+        match = self.match
+        return [match(key) for key in keys]
+
+    #give up on the probe waiting under key now instead of at its deadline, returns it or None if it
+    #wasn't waiting. a reply still turning up for it is then LATE
+    def timeout(self, key):
+        probe = self.probes.pop(key, None)
+        if probe is not None:
+            self.finish(key, probe)
+        return probe
+
+    #keep a finished probe around for linger seconds
+    def finish(self, key, probe):
+        self.finished[key] = probe
+        self.wheel.schedule((key, probe, True), time.monotonic() + self.linger)
+
+    #time out everything whose deadline has passed, returns the Probes that timed out
+    def expire(self, now):
+        expired = []
+        for key, probe, forget in self.wheel.advance(now):
+            if forget:
+                if self.finished.get(key) is probe:
+                    del self.finished[key]
+            elif self.probes.get(key) is probe:
+                del self.probes[key]
+                self.finish(key, probe)
+                expired.append(probe)
+        return expired
+
+    #the latest time expire() should be called, None if nothing is waiting
+    def nextWakeUp(self):
+        return self.wheel.nextTick() if self.probes else None
+
+
+#per host timeout that follows the host's RTT, the way TCP sets its retransmission timeout (RFC 6298)
+#srtt is the smoothed RTT and rttvar how much it varies, the timeout (rto) is srtt + 4 * rttvar,
+#so a host that answers in 2ms gets written off after a few ms instead of waiting out the full timeout
+#before the first reply it is ceiling, every timeout doubles it (up to ceiling) until a reply comes in again
+#and it never goes below floor or above ceiling. everything is in seconds
+#ping probes all have their own sequence number, so unlike TCP retransmissions a reply that comes in after
+#the timeout still tells us the RTT unambiguously, the callers feed those in too (it just counts as lost)
+class RttEstimator:
+    __slots__ = ("srtt", "rttvar", "rto", "floor", "ceiling")
+
+    #the smoothing factors and clock granularity from RFC 6298
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    GRANULARITY = 0.001
+
+    def __init__(self, floor=0.05, ceiling=1.0):
+        self.srtt = None
+        self.rttvar = None
+        self.floor = floor
+        self.ceiling = ceiling
+        self.rto = ceiling
+
+    #a reply came back after rtt seconds
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.rto = min(max(self.srtt + max(self.GRANULARITY, 4 * self.rttvar), self.floor), self.ceiling)
+
+    #a probe timed out
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.ceiling)
+
 
 #function to send an ICMP request to the destination server
 #need it to send a ping to the server
 # we send to the server a header with some data
-def sendOnePing(mySocket, destAddr, ID):
-    # Header is type (8), code (8), checksum (16), id (16), sequence (16)
-
-    myChecksum = 0
-    # Make a dummy header with a 0 checksum
-    # struct -- Interpret strings as packed binary data
-
-    #initialize the ICMP header with type code checksum id and sequence, all initially set to 0 except sequence is 1 and type
-    header = struct.pack("bbHHh", ICMP_ECHO_REQUEST, 0, myChecksum, ID, 1) # these are bbHHh arguments
-    #pack the current time as binary data, this will be sent in the ICMP packet
-    #this will be used to calc rrt when pong is recieved
-    data = struct.pack("d", time.time())
-    # Calculate the checksum on the data and the dummy header.
-    #checksum is for checking the integrity of the ICMP packet
-    myChecksum = checksum(header + data)
-
-    # Get the right checksum, and put in the header
-
-    if sys.platform == 'darwin':
-        # Convert 16-bit integers from host to network  byte order
-        myChecksum = htons(myChecksum) & 0xffff #mac od
-    else:
-        myChecksum = htons(myChecksum) #other platforms
+#seq is the ICMP sequence number, it lets us tell several probes with the same ID apart
+#the packet is built by a PacketTemplate, code that pings the same host again and again should keep the template
+#the timestamp in the payload comes from socketClock, so it matches what receiveOnePing compares it with
+def sendOnePing(mySocket, destAddr, ID, seq=1):
+    PacketTemplate(destAddr, ID).send(mySocket, seq, socketClock(mySocket))
 
-    # repack the header with the correct checsum
-    header = struct.pack("bbHHh", ICMP_ECHO_REQUEST, 0, myChecksum, ID, 1)
-    #combine it with data for final packet
-    packet = header + data
 
-    #send the packet to the destination server using the socket
-    #sendto function send packets to addreess as a tuple containg IP and port
-    #in this case, ip= destAddr and port is 1
-    mySocket.sendto(packet, (destAddr, 1))  # AF_INET address must be tuple, not str
+#open the ICMP socket for one of the modes
+#raw: SOCK_RAW, needs root (or CAP_NET_RAW) and gets a copy of every ICMP packet the host receives
+#dgram: a SOCK_DGRAM ping socket, allowed for the groups in net.ipv4.ping_group_range. the kernel picks
+#  the ICMP id (the socket's "port"), and only hands the socket the replies to its own probes, without the IP header
+#  (so the bytes we report are just the ICMP message)
+#auto: dgram if the kernel lets us, raw otherwise
+#mode can also be a transport instead of one of those names: an object whose socket() returns something that
+#works like a raw socket (type, sendto, recvfrom_into, fileno, setblocking, getsockopt, close),
+#simnet.SimulatedNetwork is one, so everything that takes a mode can run against a simulated network
+#kernelFilter is ignored for a transport, there is no kernel to attach it to
+#returns (socket, the id the kernel gave a dgram socket or None for raw)
+def openIcmpSocket(mode="raw"):
+    if metrics is None:
+        return createIcmpSocket(mode)
+    started = time.perf_counter_ns()
+    opened = createIcmpSocket(mode)
+    metrics.since("socket", started)
+    return opened
 
-    # Both LISTS and TUPLES consist of a number of objects
-    # which can be referenced by their position number within the object.
 
+#openIcmpSocket without the metrics
+def createIcmpSocket(mode):
+    if not isinstance(mode, str):
+        return mode.socket(), None
+    if mode not in ("raw", "dgram", "auto"):
+        raise ValueError(f"unknown socket mode {mode!r}, expected raw, dgram or auto")
+    if mode != "raw":
+        try:
+            mySocket = socket(AF_INET, SOCK_DGRAM, IPPROTO_ICMP)
+        except PermissionError:
+            if mode == "dgram":
+                raise
+        else:
+            #binding to port 0 makes the kernel pick a free id right away so we know it before sending
+            mySocket.bind(("", 0))
+            mySocket.setsockopt(IPPROTO_IP, IP_RECVTTL, 1)
+            return mySocket, mySocket.getsockname()[1]
+    # SOCK_RAW is a powerful socket type. For more details:   https://sock-raw.org/papers/sock_raw
+    return socket(AF_INET, SOCK_RAW, getprotobyname("icmp")), None
 
-#this function combines the sending and recieving parts
-#and creates a socket to connect to the server and then send the ping + wait for pong
-def doOnePing(destAddr, timeout):
-    icmp = getprotobyname("icmp")
 
-    # SOCK_RAW is a powerful socket type. For more details:   https://sock-raw.org/papers/sock_raw
-    mySocket = socket(AF_INET, SOCK_RAW, icmp)
+#open a socket for pinging one host and work out the ICMP id to use, the process id on a raw socket
+#or the one the kernel picked on a dgram socket. the options are the ones doOnePing takes
+#returns (socket, id)
+def openPingSocket(mode="raw", kernelFilter=False, kernelTimestamps=False):
+    mySocket, kernelID = openIcmpSocket(mode)
+    if kernelTimestamps:
+        enableKernelTimestamps(mySocket)
 
     myID = os.getpid() & 0xFFFF  # Return the current process i
+    if kernelID is not None:
+        myID = kernelID
+    elif kernelFilter and isinstance(mode, str):
+        attachReplyFilter(mySocket, myID, myID)
+    return mySocket, myID
+
+
+#this function combines the sending and recieving parts
+#and creates a socket to connect to the server and then send the ping + wait for pong
+#with kernelFilter the kernel only hands us echo replies carrying our id
+#mode picks the socket type, see openIcmpSocket. a dgram socket doesn't need the filter, the kernel already does that
+#kernelTimestamps takes the receive time from the kernel instead of after select returns, see enableKernelTimestamps
+#returns the PingResult from receiveOnePing
+def doOnePing(destAddr, timeout, kernelFilter=False, mode="raw", kernelTimestamps=False):
+    mySocket, myID = openPingSocket(mode, kernelFilter, kernelTimestamps)
     sendOnePing(mySocket, destAddr, myID)
-    delay = receiveOnePing(mySocket, myID, timeout, destAddr)
+    result = receiveOnePing(mySocket, myID, timeout, destAddr)
     mySocket.close()
-    return delay
+    return result
+
+
+#name resolution for the target lists, with a cache so a monitor or repeated ping() runs don't look
+#every host up again each cycle, and a thread pool so a long list is resolved concurrently instead of one
+#slow lookup after the other
+#gethostbyname doesn't tell us the record's TTL, so answers are kept for ttl seconds and failures
+#(negative caching) for negativeTtl seconds
+#lookup is the function that does the actual resolving (gethostbyname by default), pass a stub that answers
+#from a dict and raises gaierror for unknown names to test without a DNS server,
+#clock is what the expiry times are measured with
+class Resolver:
+    def __init__(self, ttl=300, negativeTtl=30, workers=32, lookup=gethostbyname, clock=time.monotonic):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.workers = workers
+        self.lookup = lookup
+        self.clock = clock
+        #host -> (address or None, the error if it failed, when it expires)
+        self.cache = {}
+
+    #the cached answer for host, or None if we have to look it up (again)
+    def cached(self, host, now):
+        entry = self.cache.get(host)
+        if entry is None or entry[2] <= now:
+            return None
+        return entry
+
+    #look host up and cache the answer, IP addresses go straight through without a lookup
+    def fetch(self, host):
+        try:
+            inet_aton(host)
+            if host.count(".") == 3:
+                return host, None, math.inf
+        except (OSError, TypeError):
+            pass
+        try:
+            return self.lookup(host), None, self.clock() + self.ttl
+        except (gaierror, herror, UnicodeError) as error:
+            return None, error, self.clock() + self.negativeTtl
+
+    #the address of one host, raises the lookup error (from the cache too) like gethostbyname would
+    def resolve(self, host):
+        entry = self.cached(host, self.clock())
+        if entry is None:
+            entry = self.cache[host] = self.fetch(host)
+        if entry[1] is not None:
+            raise entry[1]
+        return entry[0]
+
+    #the addresses of a whole list of hosts in the same order, None for the ones that can't be resolved
+    #everything missing from the cache is looked up at the same time, every name only once
+    def resolveMany(self, hosts):
+        now = self.clock()
+        missing = list({host: None for host in hosts if self.cached(host, now) is None})
+        if len(missing) == 1 or self.workers <= 1:
+            for host in missing:
+                self.cache[host] = self.fetch(host)
+        elif missing:
+            #only pay for importing and starting the pool when there is something to do
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(min(self.workers, len(missing))) as pool:
+                for host, entry in zip(missing, pool.map(self.fetch, missing)):
+                    self.cache[host] = entry
+        cache = self.cache
+        return [cache[host][0] for host in hosts]
+
+    #drop everything that expired, for long runs over changing target lists
+    def prune(self):
+        now = self.clock()
+        self.cache = {host: entry for host, entry in self.cache.items() if entry[2] > now}
+
+
+#shared by everything that resolves names unless it is given its own Resolver,
+#so repeated calls in one process reuse the answers
+defaultResolver = Resolver()
+
+
+#resolve every host, the ones we can't resolve become None and just never get a reply
+def resolveAll(hosts, resolver=None):
+    return (resolver or defaultResolver).resolveMany(hosts)
+
+
+#the machinery ping_many and monitor share: one socket for all hosts, a PacketTemplate per host,
+#the InFlightTable and matching replies back to their probe. hosts are referred to by their index in dests
+#on a raw socket every host gets its own ICMP id (base id + its index) and the caller picks the sequence numbers,
+#on a dgram socket every probe carries the socket's id, so there the probes are keyed by
+#(that id, a sequence number counting every probe sent) instead
+#RTTs are measured in ns on the monotonic clock, or against the kernel receive time with kernelTimestamps
+#kernelFilter, mode and kernelTimestamps are the same as for doOnePing,
+#counters is an optional ReceiveCounters that gets the counts for the run when the engine is closed
+#baseID is the first ICMP id on a raw socket, by default our process id, engines sharing a host pick
+#ranges that don't overlap so each one's kernel filter only lets its own replies through
+#with minTimeout every host gets an RttEstimator and its probes time out after its rto, somewhere between
+#minTimeout and timeout, instead of always after timeout
+#the socket is non-blocking and watched with epoll, every wakeup reads all the packets queued on it and
+#matches them in one batch. receiveBuffer sets its SO_RCVBUF in bytes, see setReceiveBuffer
+class PingEngine:
+    def __init__(self, dests, timeout=1, kernelFilter=False, mode="raw", kernelTimestamps=False, counters=None,
+                 baseID=None, minTimeout=None, receiveBuffer=None):
+        if len(dests) > 0x10000:
+            raise ValueError("a PingEngine can track at most 65536 hosts, one per ICMP id or sequence number")
+        self.dests = dests
+        self.timeout = timeout
+        self.baseID = (os.getpid() if baseID is None else baseID) & 0xFFFF
+        #one reusable packet per host, None for the hosts we couldn't resolve
+        self.templates = [PacketTemplate(dest, (self.baseID + i) & 0xFFFF) if dest is not None else None
+                          for i, dest in enumerate(dests)]
+        self.table = InFlightTable()
+        self.estimators = None
+        if minTimeout is not None:
+            self.estimators = [RttEstimator(minTimeout, timeout) for _ in dests]
+
+        self.socket, self.kernelID = openIcmpSocket(mode)
+        if kernelTimestamps:
+            enableKernelTimestamps(self.socket)
+        self.clock = socketClock(self.socket)
+        self.reader = ReplyReader(dgram=self.kernelID is not None, timestamps=kernelTimestamps)
+        if kernelFilter and self.kernelID is None and isinstance(mode, str):
+            attachReplyFilter(self.socket, self.baseID, (self.baseID + len(dests) - 1) & 0xFFFF)
+        if receiveBuffer is not None:
+            setReceiveBuffer(self.socket, receiveBuffer)
+        self.socket.setblocking(False)
+        self.poller = socketPoller(self.socket)
+        #last sequence number used on a dgram socket
+        self.probeSeq = 0
+
+        self.counters = counters
+        self.wakeups = 0
+        self.batches = 0
+        self.foreign = 0
+        if counters is not None:
+            self.icmpBefore = icmpInMessages()
+
+    #send probe number round to host i, seq is its sequence number on a raw socket
+    #returns the Probe now waiting in the table, or None if the send failed (unreachable network,
+    #full send buffer etc), which the caller should count as lost
+    #on a dgram socket the 16 bit sequence number wraps after 65536 probes, if the next one still belongs to
+    #a probe that is waiting the send is refused (None) instead of taking over its key, until that probe is done
+    def send(self, i, round, seq):
+        if self.kernelID is None:
+            key = ((self.baseID + i) & 0xFFFF, seq & 0xFFFF)
+        else:
+            key = (self.kernelID, (self.probeSeq + 1) & 0xFFFF)
+            if key in self.table.probes:
+                return None
+            self.probeSeq = key[1]
+        try:
+            sent = self.templates[i].send(self.socket, key[1], self.clock)
+        except OSError:
+            return None
+        timeout = self.estimators[i].rto if self.estimators is not None else self.timeout
+        return self.table.add(key, i, round, sent, time.monotonic() + timeout)
+
+    #time out the probes whose deadline has passed, returns their Probes
+    def expire(self, now):
+        expired = self.table.expire(now)
+        if self.estimators is not None:
+            for probe in expired:
+                self.estimators[probe.host].backoff()
+        if metrics is not None and expired:
+            metrics.count("timeouts", len(expired))
+        return expired
+
+    #wait until the socket is readable or until wakeUp (time.monotonic() seconds), True if there is a packet
+    def wait(self, wakeUp):
+        if metrics is not None:
+            started = time.perf_counter_ns()
+            events = self.poller.poll(max(0, wakeUp - time.monotonic()))
+            metrics.since("select", started)
+            return bool(events)
+        return bool(self.poller.poll(max(0, wakeUp - time.monotonic())))
+
+    #read every packet queued on the socket (up to RECEIVE_BATCH) and match the replies against the table
+    #in one go, returns a list of (Probe, rtt in ms, bytes, TTL) for the ones that answer a waiting probe
+    #duplicates and late replies are counted by the table but don't give a result
+    def receive(self):
+        if metrics is not None:
+            started = time.perf_counter_ns()
+        read, replies = drainReplies(self.socket, self.reader, self.clock)
+        self.wakeups += read
+        self.batches += 1
+        table = self.table
+        dests = self.dests
+        keys = []
+        arrivals = []
+        for key, source, timeReceived, nbytes, ttl in replies:
+            probe = table.get(key)
+            #a reply from somebody else using the same id isn't ours either
+            if probe is not None and source == dests[probe.host]:
+                keys.append(key)
+                arrivals.append((timeReceived, nbytes, ttl))
+        #everything that wasn't a reply to one of our probes
+        self.foreign += read - len(keys)
+
+        answers = []
+        estimators = self.estimators
+        for (status, probe), (timeReceived, nbytes, ttl) in zip(table.matchAll(keys), arrivals):
+            if metrics is not None:
+                metrics.count(PACKET_COUNTERS[status])
+            if estimators is not None and status != Status.DUPLICATE:
+                estimators[probe.host].sample((timeReceived - probe.sent) / 1e9)
+            if status == Status.REPLY:
+                answers.append((probe, (timeReceived - probe.sent) / 1e6, nbytes, ttl))
+        if metrics is not None:
+            metrics.since("parse", started)
+            if read > len(keys):
+                metrics.count("foreign_packets", read - len(keys))
+        return answers
+
+    def close(self):
+        self.poller.close()
+        self.socket.close()
+        counters = self.counters
+        if counters is not None:
+            counters.wakeups += self.wakeups
+            counters.batches += self.batches
+            counters.foreign += self.foreign
+            counters.kernelDropped += max(0, icmpInMessages() - self.icmpBefore - self.wakeups)
+            counters.duplicates += self.table.duplicates
+            counters.late += self.table.late
+            counters.reordered += self.table.reordered
+
+
+#the results of a batch run (ping_many, ping_sharded, async_ping_many) as columns with one entry per probe,
+#the count probes of host i come one after the other starting at i * count:
+#rtt in ms (NaN unless answered), ttl and bytes of the reply (0 unless answered), status (a Status)
+#and time, the wall clock time in ns the probe was sent (0 if it wasn't, or nobody recorded it)
+#the columns are array.arrays, so a big run costs 20 bytes per probe instead of a dict each,
+#and columns() hands them to numpy without copying
+#it still works like the dict host -> list of results it replaces: indexing it with a host gives
+#that host's PingResults, and keys, values, items, len and in work the same way
+class BatchResults:
+    COLUMNS = ("rtt", "ttl", "bytes", "status", "time")
+
+    def __init__(self, hosts, count):
+        self.hosts = list(hosts)
+        self.count = count
+        self.indexes = {host: i for i, host in enumerate(self.hosts)}
+        size = len(self.hosts) * count
+        self.rtt = array.array("d", [math.nan]) * size
+        self.ttl = array.array("B", bytes(size))
+        self.bytes = array.array("H", [0]) * size
+        self.status = array.array("B", [Status.TIMEOUT]) * size
+        self.time = array.array("q", [0]) * size
+
+    #set the result of probe number round to host i
+    def record(self, i, round, status, rtt=math.nan, ttl=0, nbytes=0):
+        at = i * self.count + round
+        self.status[at] = status
+        self.rtt[at] = rtt
+        self.ttl[at] = ttl
+        self.bytes[at] = nbytes
 
+    #the result of probe number round to host i as a PingResult
+    def result(self, i, round):
+        at = i * self.count + round
+        return PingResult(Status(self.status[at]), self.rtt[at], self.ttl[at], self.bytes[at])
 
+    #copy in the results of a run over other hosts, as hosts first, first + 1 and so on (how ping_sharded
+    #puts its shards back together)
+    def insert(self, first, other):
+        start = first * self.count
+        end = start + len(other.hosts) * self.count
+        for name in self.COLUMNS:
+            getattr(self, name)[start:end] = getattr(other, name)
+
+    #the columns as numpy arrays sharing memory with this BatchResults, a dict column name -> array,
+    #reshape them to (len(hosts), count) for one row per host
+    def columns(self):
+        import numpy as np
+        return {name: np.frombuffer(getattr(self, name), np.dtype(getattr(self, name).typecode))
+                for name in self.COLUMNS}
+
+    #a PingStats over all the probes, or over the probes of one host
+    def stats(self, host=None):
+        stats = PingStats()
+        start, end = 0, len(self.status)
+        if host is not None:
+            start = self.indexes[host] * self.count
+            end = start + self.count
+        for at in range(start, end):
+            stats.add(self.rtt[at] if self.status[at] == Status.REPLY else None)
+        return stats
+
+    def __getitem__(self, host):
+        i = self.indexes[host]
+        return [self.result(i, round) for round in range(self.count)]
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __contains__(self, host):
+        return host in self.indexes
+
+    def keys(self):
+        return self.indexes.keys()
+
+    def values(self):
+        return [self[host] for host in self.indexes]
+
+    def items(self):
+        return [(host, self[host]) for host in self.indexes]
+
+
+#ping a whole list of hosts at the same time using one socket for everything, see PingEngine
+#we send one round to all hosts, then the next round interval seconds later, and receive in between,
+#so the total time is about (count - 1) * interval + timeout no matter how many hosts there are
+#returns a BatchResults with count results for every host
+#kernelFilter, counters, mode and kernelTimestamps are passed on to the PingEngine,
+#the names are looked up with resolver (a Resolver, the shared defaultResolver if None)
+#minTimeout turns on adaptive per host timeouts between minTimeout and timeout, see PingEngine
+#with a ResultLog as log every result is written to it when the run is over, stamped with the time it was sent
+#receiveBuffer is the socket's SO_RCVBUF in bytes, raise it when many hosts answer every round at once
+def ping_many(hosts, count=4, timeout=1, interval=1, kernelFilter=False, counters=None, mode="raw",
+              kernelTimestamps=False, resolver=None, minTimeout=None, log=None, receiveBuffer=None):
+    hosts = list(hosts)
+    results = pingAddresses(resolveAll(hosts, resolver), count, timeout, interval, kernelFilter, counters, mode,
+                            kernelTimestamps, minTimeout=minTimeout, hosts=hosts, receiveBuffer=receiveBuffer)
+    if log is not None:
+        for i, host in enumerate(hosts):
+            index = log.hostIndex(host)
+            for at in range(i * count, (i + 1) * count):
+                log.write(index, at - i * count + 1, results.rtt[at], results.ttl[at],
+                          results.time[at] or None, results.status[at])
+        log.flush()
+    return results
+
+
+#the ping_many loop over already resolved addresses (None for the unresolved ones), returns a BatchResults
+#for every address in the same order, named after hosts (the addresses themselves if None)
+#baseID, minTimeout and receiveBuffer are passed on to the PingEngine
+def pingAddresses(dests, count=4, timeout=1, interval=1, kernelFilter=False, counters=None, mode="raw",
+                  kernelTimestamps=False, baseID=None, minTimeout=None, hosts=None, receiveBuffer=None):
+    results = BatchResults(dests if hosts is None else hosts, count)
+    for i, dest in enumerate(dests):
+        if dest is None:
+            for round in range(count):
+                results.record(i, round, Status.SEND_ERROR)
+
+    engine = PingEngine(dests, timeout, kernelFilter, mode, kernelTimestamps, counters, baseID, minTimeout,
+                        receiveBuffer)
+    #rounds sent so far
+    seq = 0
+    nextRound = time.monotonic()
+
+    try:
+        while seq < count or len(engine.table):
+            now = time.monotonic()
+
+            #time for the next round, send one probe to every host
+            if seq < count and now >= nextRound:
+                seq += 1
+                #the whole round goes out within a few ms, one wall clock time does for all of it
+                sentAt = time.time_ns()
+                for i, dest in enumerate(dests):
+                    if dest is not None:
+                        results.time[i * count + seq - 1] = sentAt
+                        if engine.send(i, seq - 1, seq) is None:
+                            results.record(i, seq - 1, Status.SEND_ERROR)
+                nextRound += interval
+                now = time.monotonic()
+
+            #forget about the probes that ran out of time, their result stays a timeout
+            engine.expire(now)
+
+            if seq >= count and not len(engine.table):
+                break
+
+            #sleep until a reply comes in, the next timer wheel tick or the next round is due
+            wakeUp = engine.table.nextWakeUp() or now + timeout
+            if seq < count:
+                wakeUp = min(wakeUp, nextRound)
+            if not engine.wait(wakeUp):
+                continue
+
+            for probe, rtt, nbytes, ttl in engine.receive():
+                results.record(probe.host, probe.round, Status.REPLY, rtt, ttl, nbytes)
+    finally:
+        engine.close()
+
+    return results
+
+
+#what one worker process of ping_sharded does: ping its slice of the addresses on its own socket with its own
+#range of ICMP ids, then hand back the results, its counters and one PingStats for the whole slice
+#(one histogram per shard instead of one per host keeps what goes back through the pipe small)
+def pingShard(dests, baseID, count, timeout, interval, kernelFilter, mode, kernelTimestamps, minTimeout,
+              receiveBuffer):
+    counters = ReceiveCounters()
+    results = pingAddresses(dests, count, timeout, interval, kernelFilter, counters, mode, kernelTimestamps, baseID,
+                            minTimeout, receiveBuffer=receiveBuffer)
+    return results, counters, results.stats()
+
+
+#ping_many spread over several processes, for target lists too big for one core to keep up with
+#the list is cut into one contiguous shard per worker (os.cpu_count() by default), every worker opens its own
+#socket and gets its own slice of the ICMP ids, so with the kernel filter on (the default here) each worker only
+#ever wakes up for its own replies. with mode="dgram" the kernel already sorts the replies out per socket
+#returns a BatchResults like ping_many, counters (a ReceiveCounters) gets the sum of the workers' counts
+#and stats (a PingStats) the statistics of every probe merged from all the workers
+#kernelDropped is estimated per worker from the whole host's ICMP counter, so it overcounts with several workers
+#receiveBuffer is the SO_RCVBUF of every worker's socket
+#a transport as mode is pickled into every worker, so each one works on its own copy and the counters of
+#the one passed in (SimulatedNetwork.sent and so on) stay at 0
+def ping_sharded(hosts, count=4, timeout=1, interval=1, workers=None, kernelFilter=True, counters=None,
+                 stats=None, mode="raw", kernelTimestamps=False, resolver=None, minTimeout=None, receiveBuffer=None):
+    hosts = list(hosts)
+    dests = resolveAll(hosts, resolver)
+    if mode != "dgram" and len(dests) > 0x10000:
+        raise ValueError("a sharded raw socket sweep can ping at most 65536 hosts, one per ICMP id")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(dests)))
+    size = math.ceil(len(dests) / workers) if dests else 0
+    baseID = os.getpid() & 0xFFFF
+    shards = [(dests[start:start + size], baseID + start, count, timeout, interval, kernelFilter, mode,
+               kernelTimestamps, minTimeout, receiveBuffer) for start in range(0, len(dests), size or 1)]
+
+    import multiprocessing
+    with multiprocessing.Pool(len(shards) or 1) as pool:
+        answers = pool.starmap(pingShard, shards)
+
+    results = BatchResults(hosts, count)
+    first = 0
+    for shardResults, shardCounters, shardStats in answers:
+        results.insert(first, shardResults)
+        first += len(shardResults.hosts)
+        if counters is not None:
+            for name in ReceiveCounters.__slots__:
+                setattr(counters, name, getattr(counters, name) + getattr(shardCounters, name))
+        if stats is not None:
+            stats.merge(shardStats)
+    return results
+
+
+#token bucket rate limiter: tokens drip in at rate per second up to capacity, every probe takes one
+#capacity is how big a burst can get after we were busy, by default 10ms worth of tokens
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "last")
+
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate / 100)
+        self.tokens = 1.0
+        self.last = time.monotonic() if now is None else now
+
+    #take a token if there is one
+    def take(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    #when the next token will be there
+    def nextToken(self):
+        return self.last + max(0.0, 1 - self.tokens) / self.rate
+
+
+#default monitor report, one line per host for the window that just ended
+def printReport(window, elapsed):
+    print(f"\n--- {elapsed:.1f}s ---")
+    for host, stats in window.items():
+        loss = stats.lost / stats.sent * 100.0 if stats.sent else 0.0
+        print(f"{host}: {stats.sent} sent, {stats.received} received, {loss:.1f}% loss, {stats.summary()}, "
+              f"{stats.percentileSummary()}")
+
+
+#keep pinging a list of hosts, for count probes each or until interrupted (count=None)
+#every host is probed every interval seconds (fractions are fine), the hosts take turns so the probes are spread
+#evenly over the interval instead of going out in bursts, and a token bucket makes sure we never send more than
+#rate probes per second in total. if rate is too low for that many hosts the interval just gets longer
+#every reportEvery seconds onReport(host -> PingStats for the last window, seconds since the start) is called,
+#printReport by default, None for no reports. returns host -> PingStats for the whole run
+#every probe also goes into log if it is given a ResultLog (which is flushed at the end but left open)
+#kernelFilter, counters, mode, kernelTimestamps, resolver, minTimeout and receiveBuffer are the same as for ping_many
+def monitor(hosts, interval=1, count=None, rate=1000, timeout=1, reportEvery=10, onReport=printReport,
+            kernelFilter=False, counters=None, mode="raw", kernelTimestamps=False, resolver=None, minTimeout=None,
+            log=None, receiveBuffer=None):
+    hosts = list(hosts)
+    dests = resolveAll(hosts, resolver)
+    live = [i for i, dest in enumerate(dests) if dest is not None]
+    total = [PingStats() for _ in hosts]
+    window = [PingStats() for _ in hosts]
+    if not live:
+        return dict(zip(hosts, total))
+
+    logIndexes = [log.hostIndex(host) for host in hosts] if log is not None else None
+    engine = PingEngine(dests, timeout, kernelFilter, mode, kernelTimestamps, counters, minTimeout=minTimeout,
+                        receiveBuffer=receiveBuffer)
+    start = time.monotonic()
+    bucket = TokenBucket(min(rate, len(live) / interval), now=start)
+    sentTo = [0] * len(hosts)
+    nextHost = 0
+    remaining = None if count is None else count * len(live)
+    nextReport = start + reportEvery
+
+    try:
+        while remaining is None or remaining > 0 or len(engine.table):
+            now = time.monotonic()
+
+            #send whatever the token bucket allows, to the hosts in turn
+            while remaining != 0 and bucket.take(now):
+                i = live[nextHost]
+                nextHost = (nextHost + 1) % len(live)
+                round = sentTo[i]
+                sentTo[i] += 1
+                probe = engine.send(i, round, round + 1)
+                if probe is None:
+                    total[i].add(None)
+                    window[i].add(None)
+                    if log is not None:
+                        log.write(logIndexes[i], round + 1, None, status=Status.SEND_ERROR)
+                elif log is not None:
+                    #the log has the time the probe went out, not when its answer or timeout came in
+                    probe.sentAt = time.time_ns()
+                if remaining is not None:
+                    remaining -= 1
+
+            for probe in engine.expire(now):
+                total[probe.host].add(None)
+                window[probe.host].add(None)
+                if log is not None:
+                    log.write(logIndexes[probe.host], probe.round + 1, None, timestamp=probe.sentAt)
+            if remaining == 0 and not len(engine.table):
+                break
+
+            if now >= nextReport:
+                if onReport is not None:
+                    onReport(dict(zip(hosts, window)), now - start)
+                window = [PingStats() for _ in hosts]
+                nextReport += reportEvery
+
+            #sleep until a reply comes in, the next probe may go out, a timer wheel tick or the next report
+            wakeUp = nextReport
+            if remaining != 0:
+                wakeUp = min(wakeUp, bucket.nextToken())
+            tableWakeUp = engine.table.nextWakeUp()
+            if tableWakeUp is not None:
+                wakeUp = min(wakeUp, tableWakeUp)
+            if not engine.wait(wakeUp):
+                continue
+
+            for probe, rtt, nbytes, ttl in engine.receive():
+                total[probe.host].add(rtt)
+                window[probe.host].add(rtt)
+                if log is not None:
+                    log.write(logIndexes[probe.host], probe.round + 1, rtt, ttl, probe.sentAt)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+        if log is not None:
+            log.flush()
+
+    return dict(zip(hosts, total))
+
+
+#the host addresses of a list of CIDR blocks ("10.1.0.0/16" or ipaddress.IPv4Network), one block after the other
+#it is a generator all the way down, so even a /8 is never turned into a list
+def cidrAddresses(networks):
+    for network in networks:
+        for address in network.hosts():
+            yield str(address)
+
+
+#find the live addresses in a list of CIDR blocks: every address gets exactly one echo request,
+#at most rate per second (a token bucket again), and this generator yields (address, rtt in ms) as soon as
+#the reply comes in, so a caller can start using the first live hosts while the sweep is still going
+#addresses that don't answer within timeout seconds are simply never yielded
+#a /16 takes about 65536 / rate + timeout seconds, 7.5s at the default rate
+#on a raw socket the probes are numbered with the sequence number and spill over into the next ICMP id every
+#65536 probes, so every probe has its own (id, sequence) even for a /8 and kernelFilter only has to let
+#a small range of ids through. mode and kernelTimestamps are the same as for doOnePing
+#the replies are read and matched in batches like in PingEngine, receiveBuffer is the socket's SO_RCVBUF in bytes
+def sweep(networks, rate=10000, timeout=1, kernelFilter=False, mode="raw", kernelTimestamps=False,
+          receiveBuffer=None):
+    import ipaddress
+    networks = [network if isinstance(network, ipaddress.IPv4Network) else ipaddress.IPv4Network(network, strict=False)
+                for network in networks]
+    total = sum(network.num_addresses for network in networks)
+    addresses = cidrAddresses(networks)
+
+    mySocket, kernelID = openIcmpSocket(mode)
+    poller = None
+    try:
+        if kernelTimestamps:
+            enableKernelTimestamps(mySocket)
+        clock = socketClock(mySocket)
+        reader = ReplyReader(dgram=kernelID is not None, timestamps=kernelTimestamps)
+        baseID = os.getpid() & 0xFFFF
+        if kernelFilter and kernelID is None and isinstance(mode, str):
+            attachReplyFilter(mySocket, baseID, (baseID + max(0, total - 1) // 0x10000) & 0xFFFF)
+        if receiveBuffer is not None:
+            setReceiveBuffer(mySocket, receiveBuffer)
+        mySocket.setblocking(False)
+        poller = socketPoller(mySocket)
+        table = InFlightTable()
+        bucket = TokenBucket(rate)
+        template = PacketTemplate("0.0.0.0", baseID)
+        templateID = baseID
+        #probes sent so far
+        sent = 0
+        remaining = True
+
+        while remaining or len(table):
+            now = time.monotonic()
+
+            while remaining:
+                if kernelID is None:
+                    key = ((baseID + (sent >> 16)) & 0xFFFF, sent & 0xFFFF)
+                else:
+                    key = (kernelID, sent & 0xFFFF)
+                #on a dgram socket the sequence number wraps after 65536 probes, when it comes round to a probe
+                #that is still waiting the rest wait until that one is answered or expires instead of taking its key
+                if key in table.probes or not bucket.take(now):
+                    break
+                address = next(addresses, None)
+                if address is None:
+                    remaining = False
+                    break
+                sent += 1
+                if key[0] != templateID and kernelID is None:
+                    template = PacketTemplate(address, key[0])
+                    templateID = key[0]
+                #one template for every address, just point it at the next one
+                template.address = (address, 1)
+                try:
+                    stamp = template.send(mySocket, key[1], clock)
+                except OSError:
+                    #broadcast addresses, unreachable networks: nothing will come back from those
+                    continue
+                table.add(key, address, 0, stamp, now + timeout)
+
+            table.expire(now)
+
+            wakeUp = table.nextWakeUp() or now + timeout
+            if remaining and key not in table.probes:
+                wakeUp = min(wakeUp, bucket.nextToken())
+            if not poller.poll(max(0, wakeUp - time.monotonic())):
+                continue
+
+            read, replies = drainReplies(mySocket, reader, clock)
+            keys = []
+            times = []
+            for key, source, timeReceived, nbytes, ttl in replies:
+                probe = table.get(key)
+                if probe is not None and probe.host == source:
+                    keys.append(key)
+                    times.append(timeReceived)
+            for (status, probe), timeReceived in zip(table.matchAll(keys), times):
+                if status == Status.REPLY:
+                    yield probe.host, (timeReceived - probe.sent) / 1e6
+    finally:
+        if poller is not None:
+            poller.close()
+        mySocket.close()
+
+
+#one hop of a path probed by tracePath: its distance, the address that answered from there last
+#(None until something did) and the statistics of the probes that ran out of TTL there
+class PathHop:
+    __slots__ = ("ttl", "address", "stats")
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.address = None
+        self.stats = PingStats()
+
+
+#pull (icmp type, id, sequence) of our echo request out of a packet that answers one:
+#an echo reply carries them itself, a Time Exceeded or Destination Unreachable quotes the IP header and
+#the first 8 bytes of the request that caused it after its own 8 byte header
+#returns None for anything else, including errors about packets that weren't echo requests
+def parseTraceReply(recPacket, nbytes):
+    ipHeaderLen = (recPacket[0] & 0x0F) * 4
+    icmp_type, icmp_code, icmp_checksum, icmp_id, icmp_seq = ICMP_HEADER.unpack_from(recPacket, ipHeaderLen)
+    if icmp_type == 0:
+        return icmp_type, icmp_id, icmp_seq
+    if icmp_type not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+        return None
+    quoted = ipHeaderLen + 8
+    if nbytes < quoted + 20 or recPacket[quoted + 9] != 1:
+        return None
+    quotedICMP = quoted + (recPacket[quoted] & 0x0F) * 4
+    if nbytes < quotedICMP + 8:
+        return None
+    quotedType, quotedCode, quotedChecksum, icmp_id, icmp_seq = ICMP_HEADER.unpack_from(recPacket, quotedICMP)
+    if quotedType != ICMP_ECHO_REQUEST:
+        return None
+    return icmp_type, icmp_id, icmp_seq
+
+
+#drainReplies for tracePath: keeps Time Exceeded and Destination Unreachable messages about our echo requests
+#as well as echo replies, returns (packets read, list of (icmp type, (id, sequence), source address,
+#receive time from clock))
+def drainTraceReplies(mySocket, reader, clock, limit=RECEIVE_BATCH):
+    replies = []
+    read = 0
+    while read < limit:
+        try:
+            nbytes, addr = reader.receive(mySocket)
+        except (BlockingIOError, InterruptedError):
+            break
+        read += 1
+        timeReceived = reader.received or clock()
+        reply = parseTraceReply(reader.buffer, nbytes)
+        if reply is not None:
+            replies.append((reply[0], (reply[1], reply[2]), addr[0], timeReceived))
+    return read, replies
+
+
+#default tracePath report: an mtr style table of the hops found so far
+def printPath(hops, rounds):
+    print(f"\n--- {rounds} rounds ---")
+    print(f"{'hop':>4} {'address':16} {'loss':>6} {'sent':>5} {'avg':>8} {'best':>8} {'worst':>8}")
+    for hop in hops:
+        stats = hop.stats
+        loss = stats.lost / stats.sent * 100.0 if stats.sent else 0.0
+        print(f"{hop.ttl:>3}. {hop.address or '???':16} {loss:5.1f}% {stats.sent:5} "
+              f"{stats.mean:8.2f} {stats.min:8.2f} {stats.max:8.2f}")
+
+
+#mtr style path probing: every round sends echo requests with every TTL from 1 to maxHops at once, so the whole
+#path shows up after about one RTT instead of one hop after the other. the router where a probe's TTL runs out
+#answers with Time Exceeded, which quotes the probe's id and sequence, and the host itself with an echo reply
+#the sequence number says which round and TTL a probe was, so answers are matched through an InFlightTable
+#like everywhere else, and read and matched in batches like in sweep. once the host has answered, later rounds
+#stop at its distance
+#rounds go out every interval seconds, count of them or until interrupted (count=None), and onRound(hops, rounds)
+#is called before every round after the first and at the end, printPath by default
+#returns the list of PathHops up to the host (or maxHops if it never answered)
+#needs a raw socket (or a transport), a dgram ping socket is never handed Time Exceeded messages
+def tracePath(host, maxHops=30, count=None, interval=1, timeout=1, onRound=printPath, mode="raw", resolver=None):
+    dest = (resolver or defaultResolver).resolve(host)
+    mySocket, kernelID = openIcmpSocket(mode)
+    if kernelID is not None:
+        mySocket.close()
+        raise ValueError("path probing needs a raw socket, dgram ping sockets don't see Time Exceeded messages")
+    myID = os.getpid() & 0xFFFF
+    template = PacketTemplate(dest, myID)
+    clock = socketClock(mySocket)
+    reader = ReplyReader()
+    table = InFlightTable()
+    hops = [PathHop(ttl) for ttl in range(1, maxHops + 1)]
+    #the host's distance once it has answered, until then we probe every TTL
+    reached = maxHops
+    rounds = 0
+    nextRound = time.monotonic()
+    poller = None
+
+    try:
+        mySocket.setblocking(False)
+        poller = socketPoller(mySocket)
+        while count is None or rounds < count or len(table):
+            now = time.monotonic()
+
+            if (count is None or rounds < count) and now >= nextRound:
+                if rounds and onRound is not None:
+                    onRound(hops[:reached], rounds)
+                for ttl in range(1, reached + 1):
+                    seq = (rounds * maxHops + ttl - 1) & 0xFFFF
+                    mySocket.setsockopt(IPPROTO_IP, IP_TTL, ttl)
+                    try:
+                        sent = template.send(mySocket, seq, clock)
+                    except OSError:
+                        hops[ttl - 1].stats.add(None)
+                        continue
+                    table.add((myID, seq), ttl - 1, rounds, sent, now + timeout)
+                rounds += 1
+                nextRound += interval
+                now = time.monotonic()
+
+            for probe in table.expire(now):
+                hops[probe.host].stats.add(None)
+            if count is not None and rounds >= count and not len(table):
+                break
+
+            wakeUp = table.nextWakeUp() or now + timeout
+            if count is None or rounds < count:
+                wakeUp = min(wakeUp, nextRound)
+            if not poller.poll(max(0, wakeUp - time.monotonic())):
+                continue
+
+            #every TTL of a round answers at about the same time, read them all and match them in one go
+            read, replies = drainTraceReplies(mySocket, reader, clock)
+            keys = []
+            answers = []
+            for icmp_type, key, source, timeReceived in replies:
+                if key[0] == myID and (icmp_type != 0 or source == dest):
+                    keys.append(key)
+                    answers.append((icmp_type, source, timeReceived))
+            for (status, probe), (icmp_type, source, timeReceived) in zip(table.matchAll(keys), answers):
+                if status != Status.REPLY:
+                    continue
+                hop = hops[probe.host]
+                hop.address = source
+                hop.stats.add((timeReceived - probe.sent) / 1e6)
+                if icmp_type == 0 and probe.host < reached:
+                    reached = probe.host + 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if poller is not None:
+            poller.close()
+        mySocket.close()
+
+    if onRound is not None:
+        onRound(hops[:reached], rounds)
+    return hops[:reached]
+
+
+#asyncio version of the pinger, for running inside an event loop without blocking it
+#there is one non-blocking raw socket and the loop calls readReplies whenever it is readable
+#every probe waits on a future stored under its (id, seq), the reader resolves the future when the reply arrives
+#so thousands of probes can wait at once in one thread without a select call per probe
+#asyncio is imported inside the functions that need it, it costs ~50ms at startup and the plain CLI never uses it
+#mode picks the socket type, see openIcmpSocket, kernelTimestamps uses the kernel receive time like in ping_many
+class AsyncPinger:
+    def __init__(self, mode="raw", kernelTimestamps=False):
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        self.socket, self.kernelID = openIcmpSocket(mode)
+        self.socket.setblocking(False)
+        if kernelTimestamps:
+            enableKernelTimestamps(self.socket)
+        self.clock = socketClock(self.socket)
+        #(id, seq) -> (future, destination address)
+        self.waiting = {}
+        self.reader = ReplyReader(dgram=self.kernelID is not None, timestamps=kernelTimestamps)
+        self.lastID = os.getpid() & 0xFFFF
+        self.lastSeq = 0
+        self.loop.add_reader(self.socket.fileno(), self.readReplies)
+
+    #hand out a fresh ICMP id, one per async_ping call so concurrent pings of the same host don't mix up
+    def newID(self):
+        self.lastID = (self.lastID + 1) & 0xFFFF
+        return self.lastID
+
+    #send one probe from the host's PacketTemplate and wait for its reply without blocking the loop
+    #returns a PingResult like receiveOnePing
+    async def probe(self, template, ID, seq, timeout):
+        import asyncio
+        if self.kernelID is not None:
+            #on a dgram socket every probe carries the socket's id, so the sequence number has to be unique
+            #across everything in flight on the socket, not just for this host
+            self.lastSeq = (self.lastSeq + 1) & 0xFFFF
+            ID, seq = self.kernelID, self.lastSeq
+        else:
+            #icmp_seq is 16 bits, past 65535 the number on the wire and the key wrap round to 0
+            seq &= 0xFFFF
+        key = (ID, seq)
+        if key in self.waiting:
+            #65536 probes in flight on this socket and the sequence number came round to one still waiting,
+            #taking over its key would lose it
+            return PingResult(Status.SEND_ERROR)
+        future = self.loop.create_future()
+        self.waiting[key] = (future, template.address[0])
+        try:
+            try:
+                sent = template.send(self.socket, seq, self.clock)
+            except OSError:
+                #send buffer full or network unreachable
+                return PingResult(Status.SEND_ERROR)
+            try:
+                timeReceived, size, ttl = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                return PingResult(Status.TIMEOUT)
+            return PingResult(Status.REPLY, (timeReceived - sent) / 1e6, ttl, size)
+        finally:
+            self.waiting.pop(key, None)
+
+    #called by the loop when the socket is readable, read everything that is queued
+    #and wake up the futures the replies belong to
+    def readReplies(self):
+        reader = self.reader
+        while True:
+            try:
+                nbytes, addr = reader.receive(self.socket)
+            except (BlockingIOError, InterruptedError):
+                return
+            timeReceived = reader.received or self.clock()
+            icmp_type, icmp_id, icmp_seq, ttl = reader.parse()
+            if icmp_type != 0:
+                continue
+            entry = self.waiting.get((icmp_id, icmp_seq))
+            if entry is None:
+                continue
+            future, destAddr = entry
+            if addr[0] == destAddr and not future.done():
+                future.set_result((timeReceived, nbytes, ttl))
+
+    def close(self):
+        self.loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+
+
+#ping one host count times, one probe every interval seconds, without blocking the event loop
+#probes are sent on schedule even if earlier ones are still waiting for their reply, like the real ping does
+#pinger lets several calls share one socket, if it's not given we make one just for this call
+#returns a list of count PingResults
+#mode and kernelTimestamps are only used when we make our own AsyncPinger
+async def async_ping(host, count=4, timeout=1, interval=1, pinger=None, mode="raw", kernelTimestamps=False):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    try:
+        info = await loop.getaddrinfo(host, None, family=AF_INET)
+    except (gaierror, herror):
+        return [PingResult(Status.SEND_ERROR) for _ in range(count)]
+    dest = info[0][4][0]
+
+    ownPinger = pinger is None
+    if ownPinger:
+        pinger = AsyncPinger(mode, kernelTimestamps)
+    try:
+        myID = pinger.newID()
+        template = PacketTemplate(dest, myID)
+        probes = []
+        for seq in range(1, count + 1):
+            if seq > 1:
+                await asyncio.sleep(interval)
+            probes.append(asyncio.ensure_future(pinger.probe(template, myID, seq, timeout)))
+        return list(await asyncio.gather(*probes))
+    finally:
+        if ownPinger:
+            pinger.close()
+
+
+#ping all the hosts at the same time over one shared AsyncPinger
+#returns a BatchResults like ping_many
+async def async_ping_many(hosts, count=4, timeout=1, interval=1, mode="raw", kernelTimestamps=False):
+    import asyncio
+    hosts = list(hosts)
+    pinger = AsyncPinger(mode, kernelTimestamps)
+    try:
+        answers = await asyncio.gather(*[async_ping(host, count, timeout, interval, pinger) for host in hosts])
+    finally:
+        pinger.close()
+    results = BatchResults(hosts, count)
+    for i, hostResults in enumerate(answers):
+        for round, result in enumerate(hostResults):
+            results.record(i, round, result.status, result.rtt, result.ttl, result.bytes)
+    return results
+
+
+#streaming latency histogram with log sized buckets, for percentiles without keeping every sample
+#bucket i holds the RTTs between lowest * growth^i and lowest * growth^(i+1), growth = 1 + 2 * precision,
+#so the middle of a bucket is never more than precision (1% by default) away from any RTT in it
+#with the defaults (1us to an hour) that is about 1100 buckets, but only the ones that were hit are kept
+#(a dict index -> count), one host's RTTs usually land in a few dozen of them, so a host costs a few KB at
+#most however long the run is and an empty histogram next to nothing
+#RTTs below lowest go into the first bucket and above highest into the last one, the exact min and max
+#are kept as well so the percentiles never come out beyond what was actually seen
+#histograms with the same lowest/highest/precision can be merged, from several runs or several workers
+class LatencyHistogram:
+    __slots__ = ("lowest", "highest", "precision", "logGrowth", "last", "counts", "count", "min", "max")
+
+    def __init__(self, lowest=0.001, highest=3600000.0, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self.logGrowth = math.log1p(2 * precision)
+        #the index of the last bucket
+        self.last = int(math.log(highest / lowest) / self.logGrowth)
+        self.counts = {}
+        self.count = 0
+        self.min = 0.0
+        self.max = 0.0
+
+    #record one RTT in ms
+    def add(self, rtt):
+        if rtt > self.lowest:
+            index = min(int(math.log(rtt / self.lowest) / self.logGrowth), self.last)
+        else:
+            index = 0
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        if self.count == 1 or rtt < self.min:
+            self.min = rtt
+        if self.count == 1 or rtt > self.max:
+            self.max = rtt
+
+    #add the counts of another histogram into this one
+    def merge(self, other):
+        if (other.lowest, other.highest, other.precision) != (self.lowest, self.highest, self.precision):
+            raise ValueError("can only merge histograms with the same lowest, highest and precision")
+        if not other.count:
+            return
+        counts = self.counts
+        for index, n in other.counts.items():
+            counts[index] = counts.get(index, 0) + n
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if not self.count or other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+
+    #the RTT p percent of the samples are at or below (p from 0 to 100), 0.0 if there are none
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        #the ends are known exactly
+        if rank == 1:
+            return self.min
+        if rank >= self.count:
+            return self.max
+        seen = 0
+        counts = self.counts
+        for index in sorted(counts):
+            seen += counts[index]
+            if seen >= rank:
+                break
+        #the middle of the bucket, on the log scale
+        value = self.lowest * math.exp((index + 0.5) * self.logGrowth)
+        return min(max(value, self.min), self.max)
+
+    #several percentiles in one go, as a dict p -> RTT
+    def percentiles(self, ps=(50, 90, 99, 99.9)):
+        return {p: self.percentile(p) for p in ps}
+
+
+#running statistics for one host, updated in O(1) for every probe without keeping the RTTs around
+#mean and stddev use Welford's method: keep the running mean and the sum of squared differences from it (m2)
+#so we never need the full list of samples and don't lose precision on long runs
+#the percentiles come from a LatencyHistogram, so the memory per host stays fixed too
+class PingStats:
+    __slots__ = ("sent", "received", "min", "max", "mean", "m2", "histogram")
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.min = 0.0
+        self.max = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.histogram = LatencyHistogram()
+
+    #record one probe, rtt is in ms or None if the probe was lost
+    def add(self, rtt):
+        self.sent += 1
+        if rtt is None:
+            return
+        self.received += 1
+        if self.received == 1:
+            self.min = self.max = rtt
+        elif rtt < self.min:
+            self.min = rtt
+        elif rtt > self.max:
+            self.max = rtt
+        delta = rtt - self.mean
+        self.mean += delta / self.received
+        self.m2 += delta * (rtt - self.mean)
+        self.histogram.add(rtt)
+
+    #fold in the statistics of another run or worker, the mean and m2 are combined with Chan's
+    #parallel version of Welford's method so the result is the same as if every probe had been added here
+    def merge(self, other):
+        if other.received:
+            if not self.received:
+                self.min, self.max = other.min, other.max
+            else:
+                self.min = min(self.min, other.min)
+                self.max = max(self.max, other.max)
+            received = self.received + other.received
+            delta = other.mean - self.mean
+            self.mean += delta * other.received / received
+            self.m2 += other.m2 + delta * delta * self.received * other.received / received
+            self.received = received
+        self.sent += other.sent
+        self.histogram.merge(other.histogram)
+
+    @property
+    def lost(self):
+        return self.sent - self.received
+
+    #sample standard deviation, same as pandas std()
+    @property
+    def stddev(self):
+        if self.received < 2:
+            return 0.0
+        return (self.m2 / (self.received - 1)) ** 0.5
+
+    #the usual ping summary line, this is what the CLI prints so it never has to load pandas
+    def summary(self):
+        return f"round-trip min/avg/max/stddev = {self.min:.2f}/{self.mean:.2f}/{self.max:.2f}/{self.stddev:.2f} ms"
+
+    #second summary line with the median and the tail, each within 1% of the real value
+    def percentileSummary(self):
+        values = "/".join(f"{value:.2f}" for value in self.histogram.percentiles().values())
+        return f"round-trip p50/p90/p99/p99.9 = {values} ms"
+
+    #build the one row min/avg/max/stddev table, only when somebody asks for a DataFrame
+    #pandas is imported here and not at the top, it takes hundreds of ms and tens of MB to load
+    def toDataFrame(self):
+        import pandas as pd
+        if self.received == 0:
+            return pd.DataFrame({"min": [0], "avg": [0.0], "max": [0], "stddev": [0.0]})
+        return pd.DataFrame({"min": [round(self.min, 2)],
+                             "avg": [round(self.mean, 2)],
+                             "max": [round(self.max, 2)],
+                             "stddev": [round(self.stddev, 2)]})
+
+
+#append-only binary log of every probe, for runs that go on for weeks
+#the file starts with a header (magic, record size) followed by fixed size little endian records:
+#wall clock time in ns, host index, sequence number, RTT in ms (NaN if lost), TTL, Status, 2 bytes padding
+#the host names go into a text file next to it (path + ".hosts"), line n is host index n
+#records are packed into a preallocated buffer and written batch records at a time
+#readResultLog maps the file straight into a numpy structured array without parsing anything
+LOG_MAGIC = b"PINGLOG\x01"
+LOG_HEADER = struct.Struct("<8sI4x")
+LOG_RECORD = struct.Struct("<qIIfBBxx")
+
+
+class ResultLog:
+    def __init__(self, path, batch=4096):
+        self.path = path
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_RECORD.size))
+        self.buffer = bytearray(LOG_RECORD.size * batch)
+        self.used = 0
+        self.hosts = readLogHosts(path)
+        self.hostIndexes = {host: i for i, host in enumerate(self.hosts)}
+
+    #the index of a host in this log, new hosts are added to the .hosts file
+    def hostIndex(self, host):
+        index = self.hostIndexes.get(host)
+        if index is None:
+            index = self.hostIndexes[host] = len(self.hosts)
+            self.hosts.append(host)
+            with open(self.path + ".hosts", "a") as hostsFile:
+                hostsFile.write(host + "\n")
+        return index
+
+    #log one probe, rtt in ms or None if it was lost, timestamp in ns since the epoch (now by default)
+    #status is a Status, by default REPLY if there is an rtt and TIMEOUT if there isn't
+    def write(self, host, seq, rtt, ttl=0, timestamp=None, status=None):
+        if status is None:
+            status = Status.TIMEOUT if rtt is None else Status.REPLY
+        if rtt is None:
+            rtt = math.nan
+        LOG_RECORD.pack_into(self.buffer, self.used, time.time_ns() if timestamp is None else timestamp,
+                             host, seq, rtt, ttl, status)
+        self.used += LOG_RECORD.size
+        if self.used == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.used:
+            self.file.write(memoryview(self.buffer)[:self.used])
+            self.used = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+#the host names of a result log, [] if it has none yet
+def readLogHosts(path):
+    try:
+        with open(path + ".hosts") as hostsFile:
+            return hostsFile.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+#map a result log into memory as a numpy structured array with the fields
+#time, host, seq, rtt, ttl and status, returns (records, host names)
+#nothing is read until it is used, so filtering months of records only touches the pages it needs
+#a half written record at the end (say the writer was killed) is left out
+def readResultLog(path):
+    import numpy as np
+    dtype = np.dtype({"names": ["time", "host", "seq", "rtt", "ttl", "status"],
+                      "formats": ["<i8", "<u4", "<u4", "<f4", "u1", "u1"],
+                      "offsets": [0, 8, 12, 16, 20, 21],
+                      "itemsize": LOG_RECORD.size})
+    with open(path, "rb") as logFile:
+        magic, recordSize = LOG_HEADER.unpack(logFile.read(LOG_HEADER.size))
+    if magic != LOG_MAGIC or recordSize != LOG_RECORD.size:
+        raise ValueError(f"{path} is not a result log this version can read")
+    count = (os.path.getsize(path) - LOG_HEADER.size) // LOG_RECORD.size
+    if count == 0:
+        return np.zeros(0, dtype), readLogHosts(path)
+    return np.memmap(path, dtype, "r", LOG_HEADER.size, (count,)), readLogHosts(path)
+
+
+#per host totals of a result log, all computed on whole columns at once:
+#returns host -> (probes, replies, average RTT in ms)
+def summarizeResultLog(path):
+    import numpy as np
+    records, hosts = readResultLog(path)
+    size = len(hosts)
+    replied = records["status"] == Status.REPLY
+    probes = np.bincount(records["host"], minlength=size)
+    replies = np.bincount(records["host"][replied], minlength=size)
+    rttSums = np.bincount(records["host"][replied], weights=records["rtt"][replied], minlength=size)
+    averages = np.divide(rttSums, replies, out=np.zeros(size), where=replies > 0)
+    return {host: (int(probes[i]), int(replies[i]), float(averages[i])) for i, host in enumerate(hosts)}
 
 
 #this function does the whole process several times ping pong ping pong etc
 #here we find the server's address
-#we create an empty dataframe to store info about every pin pong round
-#we do four rounds with the server , waiting 1 second btw each round
-#we save infor of each round bytes rtt ttl  in the table
-#we count how many times the server respnded and how many times it didn't (packet_loss and packet_recv)
+#we do count rounds with the server (four by default), one every interval seconds (fractions are fine)
+#all rounds go over one socket and every probe gets the next sequence number, the InFlightTable makes sure
+#a late reply to an earlier probe isn't counted as the answer to the current one
+#every round goes into a PingStats accumulator, a timeout counts as a lost packet
 #we calculate the shortest, average, longest and how spread out the responses were
-def ping(host, timeout=1):
-    dest = gethostbyname(host)
+#returns the PingStats, or the old one row min/avg/max/stddev DataFrame if asDataFrame is True
+#kernelFilter, mode and kernelTimestamps are the same as for doOnePing, resolver the same as for ping_many
+#with minTimeout the wait for each reply adapts to the host's RTT (an RttEstimator) between minTimeout and timeout
+def ping(host, timeout=1, asDataFrame=False, kernelFilter=False, mode="raw", kernelTimestamps=False, count=4,
+         interval=1, resolver=None, minTimeout=None):
+    dest = (resolver or defaultResolver).resolve(host)
     print("\nPinging " + dest + " using Python:")
     print("")
 
-    response = pd.DataFrame(columns=['bytes', 'rtt', 'ttl'])
-    packet_lost = 0
-    packet_recv = 0
+    stats = PingStats()
+    table = InFlightTable()
+    mySocket, myID = openPingSocket(mode, kernelFilter, kernelTimestamps)
+    template = PacketTemplate(dest, myID)
+    clock = socketClock(mySocket)
+    estimator = RttEstimator(minTimeout, timeout) if minTimeout is not None else None
 
-    for i in range(0, 4):
-        result = doOnePing(dest, timeout)
-        #print(f"Result from doOnePing: {result}")  # Add this line
+    nextSend = time.monotonic()
 
-        if len(result) == 2:
-            delay, statistics = result
-        else:
-            print(f"{result}")
-            continue
-
-        if statistics:
-            response = response.append(statistics, ignore_index=True)
-        else:
-            response = response.append({'bytes': 0, 'rtt': 0, 'ttl': 0}, ignore_index=True)
-        print(delay)
-        time.sleep(1)
+    try:
+        for seq in range(1, count + 1):
+            #the rounds go out on a fixed schedule, however long the previous one took to come back
+            time.sleep(max(0, nextSend - time.monotonic()))
+            nextSend += interval
+            table.expire(time.monotonic())
+            probeTimeout = estimator.rto if estimator is not None else timeout
+            #icmp_seq is 16 bits, past 65535 it wraps round and the key has to wrap with it
+            wire = seq & 0xFFFF
+            sent = template.send(mySocket, wire, clock)
+            table.add((myID, wire), 0, seq - 1, sent, time.monotonic() + probeTimeout)
+            result = receiveOnePing(mySocket, myID, probeTimeout, dest, table, wire)
+            print(formatResult(result, dest))
 
+            if result.status != Status.REPLY:
+                stats.add(None)
+                if estimator is not None:
+                    estimator.backoff()
+                continue
 
-    for index, row in response.iterrows():
-        if row['rtt'] == 0:
-            packet_lost += 1
-        else:
-            packet_recv += 1
+            if metrics is not None:
+                started = time.perf_counter_ns()
+                stats.add(result.rtt)
+                metrics.since("stats", started)
+            else:
+                stats.add(result.rtt)
+            if estimator is not None:
+                estimator.sample(result.rtt / 1000)
+    finally:
+        mySocket.close()
 
+    extra = ""
+    if table.duplicates:
+        extra += f", +{table.duplicates} duplicates"
+    if table.late:
+        extra += f", {table.late} late replies"
     print(f"\n--- {host} ping statistics ---")
-    if len(response) > 0:
-        print(
-            f"{len(response)} packets transmitted, {packet_recv} packets received, {packet_lost / len(response) * 100.0:.1f}% packet loss")
-    else:
-        print("4 packets transmitted, 0 packets received, 100% packet loss")
-
+    print(
+        f"{stats.sent} packets transmitted, {stats.received} packets received{extra}, {stats.lost / stats.sent * 100.0:.1f}% packet loss")
 
-    if packet_recv == 0:
-        vars = pd.DataFrame({"min": [0], "avg": [0.0], "max": [0], "stddev": [0.0]})
-    else:
-        vars = pd.DataFrame({"min": [round(response['rtt'].min(), 2)],
-                             "avg": [round(response['rtt'].mean(), 2)],
-                             "max": [round(response['rtt'].max(), 2)],
-                             "stddev": [round(response['rtt'].std(), 2)]})
-    print(vars)
-    return vars
+    if asDataFrame:
+        if metrics is not None:
+            started = time.perf_counter_ns()
+            vars = stats.toDataFrame()
+            metrics.since("dataframe", started)
+        else:
+            vars = stats.toDataFrame()
+        print(vars)
+        return vars
+    print(stats.summary())
+    print(stats.percentileSummary())
+    return stats
 
 
 #this part of the code checks if we are running this file directly and starts the process is we are
+#with no hosts on the command line it pings the same three hosts as always
+#--monitor keeps going (or does -c rounds) and prints rolling statistics every --report seconds instead
+#--sweep takes CIDR blocks instead of hosts and prints every address that answers
+#--log appends every probe of a --monitor run to a binary result log, --replay prints the totals of one
+#--path probes the route to every host, all TTLs at once, and prints per hop statistics like mtr
 if __name__ == '__main__':
-    #ping("127.0.0.1")
-    ping("google.com")
-    ping("nyu.edu")
-    ping("yahoo.com")
+    import argparse
+    parser = argparse.ArgumentParser(description="ICMP echo pinger")
+    parser.add_argument("hosts", nargs="*", default=["google.com", "nyu.edu", "yahoo.com"])
+    parser.add_argument("-c", "--count", type=int, help="probes per host (default 4, unlimited with --monitor)")
+    parser.add_argument("-i", "--interval", type=float, default=1, help="seconds between probes to a host")
+    parser.add_argument("-W", "--timeout", type=float, default=1, help="seconds to wait for each reply")
+    parser.add_argument("--min-timeout", type=float,
+                        help="adapt the timeout to each host's RTT, between this and --timeout seconds")
+    parser.add_argument("--monitor", action="store_true", help="probe all hosts continuously")
+    parser.add_argument("--sweep", action="store_true", help="find the live addresses in CIDR blocks")
+    parser.add_argument("--path", action="store_true", help="probe every hop on the way to the hosts (mtr style)")
+    parser.add_argument("--max-hops", type=int, default=30, help="longest path to probe (--path)")
+    parser.add_argument("--rate", type=float,
+                        help="most probes per second over all hosts (--monitor 1000, --sweep 10000)")
+    parser.add_argument("--report", type=float, default=10, help="seconds between reports (--monitor)")
+    parser.add_argument("--log", help="append every probe to this binary result log (--monitor)")
+    parser.add_argument("--rcvbuf", type=int, metavar="BYTES",
+                        help="socket receive buffer, for big bursts of replies (--monitor, --sweep)")
+    parser.add_argument("--replay", metavar="LOG", help="print per host totals from a result log and exit")
+    parser.add_argument("--mode", choices=["raw", "dgram", "auto"], default="raw")
+    parser.add_argument("--kernel-filter", action="store_true")
+    parser.add_argument("--kernel-timestamps", action="store_true")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port while running")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        enableMetrics()
+        serveMetrics(args.metrics_port)
+
+    if args.replay:
+        for host, (probes, replies, average) in summarizeResultLog(args.replay).items():
+            loss = (probes - replies) / probes * 100.0 if probes else 0.0
+            print(f"{host}: {probes} sent, {replies} received, {loss:.1f}% loss, avg {average:.2f} ms")
+    elif args.path:
+        for host in args.hosts:
+            print(f"\nPath to {host}:")
+            tracePath(host, args.max_hops, args.count, args.interval, args.timeout, mode=args.mode)
+    elif args.sweep:
+        live = 0
+        try:
+            for address, rtt in sweep(args.hosts, args.rate or 10000, args.timeout, args.kernel_filter, args.mode,
+                                      args.kernel_timestamps, args.rcvbuf):
+                live += 1
+                print(f"{address} is alive, time={rtt:.2f}ms")
+        except KeyboardInterrupt:
+            pass
+        print(f"\n{live} live hosts")
+    elif args.monitor:
+        start = time.monotonic()
+        log = ResultLog(args.log) if args.log else None
+        try:
+            totals = monitor(args.hosts, args.interval, args.count, args.rate or 1000, args.timeout, args.report,
+                             kernelFilter=args.kernel_filter, mode=args.mode, kernelTimestamps=args.kernel_timestamps,
+                             minTimeout=args.min_timeout, log=log, receiveBuffer=args.rcvbuf)
+        finally:
+            if log is not None:
+                log.close()
+        printReport(totals, time.monotonic() - start)
+    else:
+        #look all the hosts up at once, ping() then finds them in the cache
+        defaultResolver.resolveMany(args.hosts)
+        for host in args.hosts:
+            ping(host, args.timeout, kernelFilter=args.kernel_filter, mode=args.mode,
+                 kernelTimestamps=args.kernel_timestamps, count=args.count or 4, interval=args.interval,
+                 minTimeout=args.min_timeout)
 
 
@@ -6,10 +6,8 @@ import struct  # Import struct library for working with C-style data structures
 import time  # Import time library for working with time
 import select  # Import select library for I/O multiplexing
 import binascii  # Import binascii library for working with binary data
-import pandas as pd  # Import pandas library for data manipulation
-import warnings  # Import warnings library for handling warnings
-warnings.simplefilter(action='ignore', category=FutureWarning)  # Suppress FutureWarning
 from socket import gethostbyaddr  # Import gethostbyaddr function for reverse DNS lookup
+from pinger import PingStats  # Import the streaming statistics accumulator shared with pinger.py
 
 # Define constant for ICMP echo request used in ping
 ICMP_ECHO_REQUEST = 8
@@ -258,13 +256,14 @@ def doOnePing(destAddr, timeout):
 #we calculate the shortest, average, longest and how spread out the responses were
 
 
-def ping(host, timeout=1):
+def ping(host, timeout=1, asDataFrame=False):
     """
         Perform several ping-pong iterations with the server and collect statistics.
 
         Args:
         host (str): The hostname or IP address of the target server.
         timeout (float, optional): Time to wait for a response in seconds. Defaults to 1.
+        asDataFrame (bool, optional): Return the statistics as a pandas DataFrame instead of the PingStats. Defaults to False.
         """
     dest = gethostbyname(
         host)  # Resolve the host to its IP address. This allows us to ping servers by hostname or IP address.
@@ -272,10 +271,7 @@ def ping(host, timeout=1):
     print("\nPinging " + dest + " using Python:")
     print("")
 
-    response = pd.DataFrame(columns=['bytes', 'rtt','ttl'])  # Create an empty DataFrame to store packet statistics. This will be used to compute statistics at the end of the process.
-
-    packet_lost = 0  # Initialize the packet_lost counter. This will be used to calculate the packet loss percentage.
-    packet_recv = 0  # Initialize the packet_recv counter. This will be used to track the number of received packets.
+    stats = PingStats()  # Create a streaming statistics accumulator. It is updated once per packet and does not keep the individual RTTs.
 
     # Perform four ping-pong iterations with the server
     for i in range(0, 4):
@@ -285,62 +281,34 @@ def ping(host, timeout=1):
         if len(result) == 2:
             # Check if the result contains both delay and statistics. This is to ensure that the result is in the expected format.
             delay, statistics = result
-            # Unpack the result into delay and statistics variables. We will use these values to update the response DataFrame.
+            # Unpack the result into delay and statistics variables. We will use these values to update the accumulator.
         else:
+            stats.add(None)  # A timeout counts as a transmitted but lost packet.
             print(result)
             continue
             # If the result is unexpected, continue with the next iteration.
 
-        # Append the statistics to the response DataFrame
-        if statistics:
-            response = response.append(statistics,ignore_index=True)
-            # Add the statistics to the DataFrame. This will update the DataFrame with the new values.
-        else:
-            response = response.append({'bytes': 0, 'rtt': 0, 'ttl': 0},ignore_index=True)
-            # If no statistics are provided, add zeros to the DataFrame.
+        stats.add(statistics['rtt'])  # Add the RTT to the accumulator. This updates min, max, mean and stddev in constant time.
 
         print(delay)  # Print the delay for the current iteration.
         time.sleep(1)  # Wait for one second before the next iteration. This is to simulate the behavior of the standard ping command.
 
-    # Calculate the number of packets lost and received
-    for index, row in response.iterrows():  # Iterate through each row in the response DataFrame.
-        if row['rtt'] == 0:  # If the RTT is 0, it means that the
-            # packet was lost.
-            packet_lost += 1  # Increment the packet_lost counter.
-        else:
-            packet_recv += 1  # Increment the packet_recv counter for received packets.
-
-            # Print the ping statistics
+    # Print the ping statistics
     print(f"\n--- {host} ping statistics ---")
-    if len(response) > 0:
-        # Check if there are any packets in the response DataFrame.
-        # This means at least one packet was transmitted during the ping process.
-        print(
-            f"{len(response)} packets transmitted, {packet_recv} packets received, {packet_lost / len(response) * 100.0:.1f}% packet loss")
-        # Print the total number of packets transmitted (length of the response DataFrame).
-        # Also, print the number of packets received (packet_recv) and calculate the packet loss percentage.
-    else:
-        print("4 packets transmitted, 0 packets received, 100% packet loss")
-        # If there are no packets in the response DataFrame, it means all packets were lost.
-        # Print the packet loss message.
-
-        # Calculate the minimum, average, maximum, and standard deviation of the RTTs
-    if packet_recv == 0:
-        # Check if no packets were received (packet_recv is 0).
-        vars = pd.DataFrame({"min": [0], "avg": [0.0], "max": [0], "stddev": [0.0]})
+    print(
+        f"{stats.sent} packets transmitted, {stats.received} packets received, {stats.lost / stats.sent * 100.0:.1f}% packet loss")
+    # Print the total number of packets transmitted, the number of packets received and the packet loss percentage.
+
+    if asDataFrame:
+        vars = stats.toDataFrame()
+        # pandas is only imported here, inside toDataFrame, so a run that doesn't ask for a DataFrame never imports it.
+        # Build the minimum, average, maximum, and standard deviation table once, at the end of the run.
         # If no packets were received, all statistics are set to 0.
-        # Create a DataFrame with zero values for minimum, average, maximum, and standard deviation of RTTs.
-    else:
-        # If there are received packets, calculate the statistics.
-        vars = pd.DataFrame({"min": [round(response['rtt'].min(), 2)],"avg": [round(response['rtt'].mean(), 2)],
-                             "max": [round(response['rtt'].max(), 2)],"stddev": [round(response['rtt'].std(), 2)]})
-        # Calculate the minimum of the RTTs in the response DataFrame and round it to 2 decimal places.
-        # Calculate the average (mean) of the RTTs in the response DataFrame and round it to 2 decimal places.
-        # Calculate the maximum of the RTTs in the response DataFrame and round it to 2 decimal places.
-        # Calculate the standard deviation of the RTTs in the response DataFrame and round it to 2 decimal places.
-        # Create a DataFrame with calculated values for minimum, average, maximum, and standard deviation of RTTs.
-    print(vars)
-    return vars
+        print(vars)
+        return vars
+    print(stats.summary())  # Print min/avg/max/stddev without building a DataFrame.
+    print(stats.percentileSummary())  # Print the RTT percentiles from the histogram.
+    return stats
 
 
 
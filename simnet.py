@@ -0,0 +1,223 @@
+#simulated network for load and regression testing the pinger without root or a real network
+#pass a SimulatedNetwork anywhere the pinger takes a mode ("raw", "dgram", "auto") and it is used instead of
+#a real socket: every echo request sent through it is answered by an imaginary host after a latency drawn from
+#that host's distribution, or lost, duplicated or held back so it arrives out of order
+#the replies are real IPv4 + ICMP echo reply packets, so the whole receive path (parsing, matching, statistics)
+#runs exactly as it does on a raw socket
+#
+#all the random choices come from one seeded random.Random and are made when the request is sent,
+#so the same probes in the same order always get the same fate. only the wall clock timing is real
+#
+#every socket has a thread that moves replies from a heap ordered by arrival time to a ready queue when they
+#are due. there is a byte in a pipe whenever the ready queue isn't empty and select, epoll and asyncio watch
+#that pipe, so to the code using it the socket behaves like a real one. it is meant for tens of thousands of hosts: only the hosts that
+#aren't like the default need an entry in hosts
+import errno
+import heapq
+import itertools
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+from collections import deque
+from socket import inet_aton, IPPROTO_IP, IP_TTL, MSG_DONTWAIT, SOCK_RAW
+import pinger
+
+#the IPv4 header of a reply: version/IHL, TOS, total length, id, fragment, TTL, protocol (1 = ICMP), checksum,
+#source, destination
+IP_HEADER = struct.Struct("!BBHHHBBH4s4s")
+
+
+#latency distributions, each returns a function that takes the random.Random and gives the latency in seconds
+#base plus exponentially distributed extra delay averaging mean, the usual shape of queueing delay
+def exponentialLatency(base, mean):
+    return lambda rng: base + rng.expovariate(1 / mean) if mean > 0 else base
+
+
+#log normal around median, sigma is the spread on the log scale, gives the long tail real paths have
+def lognormalLatency(median, sigma):
+    return lambda rng: median * math.exp(rng.gauss(0, sigma))
+
+
+#how one imaginary host behaves
+#latency: seconds, a number or one of the distributions above (any function of the random.Random)
+#loss: chance a request gets no reply, duplicate: chance the reply arrives twice,
+#reorder: chance a reply is held back reorderDelay extra seconds, so later replies overtake it
+#ttl: the TTL the replies arrive with
+#route: the addresses of the routers on the way to the host, a probe whose TTL runs out at router n
+#gets an ICMP Time Exceeded back from it after n / (len(route) + 1) of the host's latency
+class SimulatedHost:
+    __slots__ = ("latency", "loss", "duplicate", "reorder", "reorderDelay", "ttl", "route")
+
+    def __init__(self, latency=0.001, loss=0.0, duplicate=0.0, reorder=0.0, reorderDelay=0.01, ttl=64, route=()):
+        self.latency = latency
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorderDelay = reorderDelay
+        self.ttl = ttl
+        self.route = route
+
+
+#the network: hosts maps addresses to SimulatedHosts, every other address behaves like default
+#(a host answering in 1ms), pass SimulatedHost(loss=1.0) as default to only have the listed hosts alive
+#queueLimit is how many replies a socket holds before it drops new ones, like a full receive buffer
+#the counters add up what happened to every request over all sockets
+class SimulatedNetwork:
+    def __init__(self, hosts=None, default=None, seed=0, queueLimit=4096, address="127.0.0.1"):
+        self.hosts = hosts if hosts is not None else {}
+        self.default = default if default is not None else SimulatedHost()
+        self.rng = random.Random(seed)
+        self.queueLimit = queueLimit
+        self.address = inet_aton(address)
+        self.sent = 0
+        self.lost = 0
+        self.duplicated = 0
+        self.reordered = 0
+        self.dropped = 0
+
+    def host(self, address):
+        return self.hosts.get(address, self.default)
+
+    #a new socket on this network, what openIcmpSocket hands out for it
+    def socket(self):
+        return SimulatedSocket(self)
+
+
+#the socket-like end of a SimulatedNetwork, it has the parts of the socket API the pinger uses:
+#sendto, recvfrom_into, fileno, setblocking, getsockopt and close
+#IP_TTL can be set for the probes that follow, other socket options (kernel filter, kernel timestamps)
+#don't exist here and raise OSError
+class SimulatedSocket:
+    #it hands over whole IP packets like a raw socket does
+    type = SOCK_RAW
+
+    def __init__(self, network):
+        self.network = network
+        self.readFd, self.writeFd = os.pipe()
+        #(due time.monotonic(), tie breaker, packet, source address) of the replies on their way
+        self.pending = []
+        self.order = itertools.count()
+        #replies that have arrived, the pipe has one byte in it as long as there are any
+        self.ready = deque()
+        self.condition = threading.Condition()
+        self.blocking = True
+        #the TTL probes leave with
+        self.ttl = 64
+        self.closed = False
+        self.thread = threading.Thread(target=self.deliver, name="simnet delivery", daemon=True)
+        self.thread.start()
+
+    #answer an echo request: decide its fate now and queue the replies for when they arrive
+    def sendto(self, packet, address):
+        network = self.network
+        network.sent += 1
+        if packet[0] != pinger.ICMP_ECHO_REQUEST:
+            return len(packet)
+        host = network.host(address[0])
+        rng = network.rng
+        if host.loss and rng.random() < host.loss:
+            network.lost += 1
+            return len(packet)
+        copies = 1
+        if host.duplicate and rng.random() < host.duplicate:
+            network.duplicated += 1
+            copies = 2
+
+        if self.ttl <= len(host.route):
+            #the TTL runs out on the way: Time Exceeded from that router, quoting our IP header and
+            #the first 8 bytes of the request like a real router does
+            router = host.route[self.ttl - 1]
+            quoted = IP_HEADER.pack(0x45, 0, IP_HEADER.size + len(packet), 0, 0, 1, 1, 0, network.address,
+                                    inet_aton(address[0])) + bytes(packet[:8])
+            icmp = bytearray(b"\x0b\0\0\0\0\0\0\0" + quoted)
+            replyFrom, replyTTL, share = router, 64 - self.ttl, self.ttl / (len(host.route) + 1)
+        else:
+            #the echo reply: same id, sequence and payload, type 0
+            icmp = bytearray(packet)
+            icmp[0] = 0
+            icmp[2:4] = b"\0\0"
+            replyFrom, replyTTL, share = address[0], host.ttl, 1
+        pinger.CHECKSUM_FIELD.pack_into(icmp, 2, pinger.checksum(icmp))
+        reply = IP_HEADER.pack(0x45, 0, IP_HEADER.size + len(icmp), 0, 0, replyTTL, 1, 0,
+                               inet_aton(replyFrom), network.address) + icmp
+        source = (replyFrom, 0)
+
+        now = time.monotonic()
+        with self.condition:
+            earliest = self.pending[0][0] if self.pending else math.inf
+            for copy in range(copies):
+                latency = (host.latency(rng) if callable(host.latency) else host.latency) * share
+                if host.reorder and rng.random() < host.reorder:
+                    network.reordered += 1
+                    latency += host.reorderDelay
+                heapq.heappush(self.pending, (now + latency, next(self.order), reply, source))
+            #the delivery thread only needs waking up if it is now sleeping too long
+            if self.pending[0][0] < earliest:
+                self.condition.notify()
+        return len(packet)
+
+    #the delivery thread: sleep until the next reply is due, then hand it over
+    def deliver(self):
+        pending = self.pending
+        with self.condition:
+            while not self.closed:
+                if not pending:
+                    self.condition.wait()
+                    continue
+                wait = pending[0][0] - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                due, order, reply, source = heapq.heappop(pending)
+                if len(self.ready) >= self.network.queueLimit:
+                    self.network.dropped += 1
+                    continue
+                self.ready.append((reply, source))
+                if len(self.ready) == 1:
+                    os.write(self.writeFd, b"\0")
+
+    #blocks until a reply is there, or raises BlockingIOError after setblocking(False) or with MSG_DONTWAIT,
+    #like a socket
+    def recvfrom_into(self, buffer, nbytes=0, flags=0):
+        while True:
+            with self.condition:
+                if self.ready:
+                    reply, source = self.ready.popleft()
+                    if not self.ready:
+                        os.read(self.readFd, 1)
+                    break
+            if not self.blocking or flags & MSG_DONTWAIT:
+                raise BlockingIOError(errno.EAGAIN, "no reply waiting")
+            select.select([self.readFd], [], [])
+        size = min(len(reply), nbytes or len(buffer))
+        buffer[:size] = reply[:size]
+        return size, source
+
+    def fileno(self):
+        return self.readFd
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def getsockopt(self, level, option):
+        return 0
+
+    def setsockopt(self, level, option, value):
+        if (level, option) == (IPPROTO_IP, IP_TTL):
+            self.ttl = value
+            return
+        raise OSError(errno.ENOPROTOOPT, "socket options are not supported on a simulated network")
+
+    def close(self):
+        if self.closed:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        os.close(self.readFd)
+        os.close(self.writeFd)
@@ -0,0 +1,420 @@
+#tests for the pinger, none of them need root or a network: the packets go over simnet
+#   python -m pytest test_pinger.py
+from socket import gaierror, EAI_NONAME, SOCK_RAW
+import os
+import time
+import random
+import struct
+import statistics
+import math
+import pinger
+import simnet
+
+
+#the original checksum loop, kept here as the reference the fast one has to match bit for bit
+def loopChecksum(string):
+    csum = 0
+    countTo = (len(string) // 2) * 2
+    count = 0
+    while count < countTo:
+        thisVal = (string[count + 1]) * 256 + (string[count])
+        csum += thisVal
+        csum &= 0xffffffff
+        count += 2
+    if countTo < len(string):
+        csum += (string[len(string) - 1])
+        csum &= 0xffffffff
+    csum = (csum >> 16) + (csum & 0xffff)
+    csum = csum + (csum >> 16)
+    answer = ~csum
+    answer = answer & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return answer
+
+
+#make sure checksum() and checksumUpdate() give exactly the same answers as the reference loop
+#random packets of every size up to 1500 bytes plus a few worst cases, then patch the sequence
+#number and timestamp of an echo request and compare the incremental result with a full recompute
+def testChecksum():
+    rng = random.Random(1)
+    packets = [bytes(rng.getrandbits(8) for _ in range(size)) for size in range(1501)]
+    packets += [b"\xff" * 1500, b"\xff" * 1501, b"\0" * 1500, b"\xff" * 200000]
+    for packet in packets:
+        assert pinger.checksum(packet) == loopChecksum(packet), len(packet)
+        assert pinger.checksum(bytearray(packet)) == loopChecksum(packet), len(packet)
+
+    for i in range(10000):
+        ID, seq, newSeq = rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16)
+        stamp, newStamp = struct.pack("d", rng.random() * 2e9), struct.pack("d", rng.random() * 2e9)
+        packet = struct.pack("!bbHHH", 8, 0, 0, ID, seq) + stamp
+        newPacket = struct.pack("!bbHHH", 8, 0, 0, ID, newSeq) + newStamp
+        updated = pinger.checksumUpdate(loopChecksum(packet), packet[6:], newPacket[6:])
+        assert updated == loopChecksum(newPacket), (packet, newPacket)
+
+
+#exact percentile by sorting, what the histogram has to come within precision of
+def exactPercentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+
+#feed a LatencyHistogram and PingStats long tailed RTTs and compare them with the exact answers:
+#percentiles within 1%, and merging two halves has to give the same as adding everything to one
+def testHistogram():
+    rng = random.Random(2)
+    samples = [rng.lognormvariate(0, 1.5) for _ in range(100000)] + [0.0, 1e-6, 5e6]
+    whole, first, second = pinger.PingStats(), pinger.PingStats(), pinger.PingStats()
+    for i, rtt in enumerate(samples):
+        whole.add(rtt)
+        (first if i % 2 else second).add(rtt)
+    first.add(None)
+    first.merge(second)
+    for p in (0, 1, 50, 90, 99, 99.9, 100):
+        exact = exactPercentile(samples, p)
+        for stats in (whole, first):
+            assert abs(stats.histogram.percentile(p) - exact) <= exact * 0.01 + 1e-9, (p, exact)
+    assert first.histogram.counts == whole.histogram.counts
+    assert (first.sent, first.received, first.min, first.max) == (len(samples) + 1, len(samples), 0.0, 5e6)
+    assert math.isclose(first.mean, statistics.fmean(samples))
+    assert math.isclose(first.stddev, statistics.stdev(samples))
+
+
+#a stand-in for DNS: answers from a hosts table after delay seconds, counts every lookup
+class StubLookup:
+    def __init__(self, hosts, delay=0.0):
+        self.hosts = hosts
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, host):
+        self.calls.append(host)
+        time.sleep(self.delay)
+        try:
+            return self.hosts[host]
+        except KeyError:
+            raise gaierror(EAI_NONAME, "Name or service not known") from None
+
+
+#check the Resolver against a stub: a slow list resolves concurrently, every name is looked up once,
+#answers (and failures) come from the cache until their TTL runs out, IP addresses are never looked up
+def testResolver():
+    hosts = {f"host{i}.test": f"10.0.{i // 256}.{i % 256}" for i in range(200)}
+    stub = StubLookup(hosts, delay=0.02)
+    now = [0.0]
+    resolver = pinger.Resolver(ttl=60, negativeTtl=5, workers=50, lookup=stub, clock=lambda: now[0])
+    names = list(hosts) + ["missing.test", "127.0.0.1"] + list(hosts)[:10]
+    started = time.perf_counter()
+    dests = resolver.resolveMany(names)
+    #200 lookups of 20ms one after the other would take 4s
+    assert time.perf_counter() - started < 1.0
+    assert dests == [hosts.get(name, "127.0.0.1" if name == "127.0.0.1" else None) for name in names]
+    assert sorted(stub.calls) == sorted(list(hosts) + ["missing.test"])
+
+    stub.calls.clear()
+    now[0] = 4.0
+    assert resolver.resolveMany(names) == dests and stub.calls == []
+    try:
+        resolver.resolve("missing.test")
+        raise AssertionError("missing.test resolved")
+    except gaierror:
+        pass
+    now[0] = 6.0
+    assert resolver.resolve("host1.test") == "10.0.0.1" and stub.calls == []
+    resolver.resolveMany(names)
+    assert stub.calls == ["missing.test"]
+    now[0] = 61.0
+    resolver.prune()
+    assert set(resolver.cache) == {"127.0.0.1"}
+
+
+#RttEstimator against RFC 6298 worked by hand: first sample, smoothing, floor, backoff and ceiling
+def testRttEstimator():
+    estimator = pinger.RttEstimator(floor=0.01, ceiling=1.0)
+    assert estimator.rto == 1.0
+    estimator.sample(0.1)
+    assert (estimator.srtt, estimator.rttvar) == (0.1, 0.05) and math.isclose(estimator.rto, 0.3)
+    estimator.sample(0.02)
+    assert math.isclose(estimator.rttvar, 0.0575) and math.isclose(estimator.srtt, 0.09)
+    assert math.isclose(estimator.rto, 0.09 + 4 * 0.0575)
+    for i in range(100):
+        estimator.sample(0.002)
+    assert estimator.rto == 0.01
+    for expected in (0.02, 0.04, 0.08, 0.16, 0.32, 0.64, 1.0, 1.0):
+        estimator.backoff()
+        assert math.isclose(estimator.rto, expected)
+
+
+#write a result log in several sessions, read it back through numpy and check every field survived,
+#including a half written record at the end that has to be left out
+def testResultLog():
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "results.log")
+        expected = []
+        for session in range(3):
+            log = pinger.ResultLog(path, batch=7)
+            for i in range(1000):
+                host = log.hostIndex(f"host{(i + session) % 5}")
+                rtt = None if i % 10 == 0 else i / 8
+                log.write(host, i, rtt, 64, timestamp=session * 10 ** 9 + i)
+                expected.append((session * 10 ** 9 + i, host, i, rtt))
+            log.close()
+        with open(path, "ab") as logFile:
+            logFile.write(b"\1" * 5)
+        records, hosts = pinger.readResultLog(path)
+        assert hosts == [f"host{i}" for i in range(5)]
+        assert len(records) == len(expected)
+        for record, (timestamp, host, seq, rtt) in zip(records, expected):
+            assert (record["time"], record["host"], record["seq"], record["ttl"]) == (timestamp, host, seq, 64)
+            if rtt is None:
+                assert record["status"] == pinger.Status.TIMEOUT and math.isnan(record["rtt"])
+            else:
+                assert record["status"] == pinger.Status.REPLY and record["rtt"] == rtt
+        summary = pinger.summarizeResultLog(path)
+        assert sum(probes for probes, replies, average in summary.values()) == 3000
+        assert sum(replies for probes, replies, average in summary.values()) == 2700
+        del records
+
+
+#run the same sweep twice over a lossy, duplicating, reordering simulated network with the same seed:
+#which probes got lost has to be identical, and the pinger has to account for every duplicate and reply
+def testSimulatedNetwork():
+    hosts = [f"10.0.{i // 256}.{i % 256}" for i in range(500)]
+    runs = []
+    for attempt in range(2):
+        network = simnet.SimulatedNetwork({"10.0.0.7": simnet.SimulatedHost(loss=1.0)},
+                                          simnet.SimulatedHost(simnet.lognormalLatency(0.002, 0.5), loss=0.1,
+                                                               duplicate=0.05, reorder=0.05), seed=3)
+        counters = pinger.ReceiveCounters()
+        results = pinger.ping_many(hosts, count=3, timeout=0.5, interval=0.05, counters=counters, mode=network)
+        answered = [[result.status == pinger.Status.REPLY for result in results[host]] for host in hosts]
+        assert not any(answered[7])
+        assert sum(map(sum, answered)) == network.sent - network.lost
+        columns = results.columns()
+        assert list(columns["status"] == pinger.Status.REPLY) == [ok for row in answered for ok in row]
+        assert (columns["ttl"][columns["status"] == pinger.Status.REPLY] == 64).all()
+        assert counters.duplicates == network.duplicated and counters.foreign == 0
+        #replies that arrive together are read in one wakeup
+        assert counters.batches < counters.wakeups
+        runs.append(answered)
+    assert runs[0] == runs[1]
+
+
+#probe a simulated three router path: every hop has to be found at the right distance in the first round
+#and nothing past the host is reported. the hops are 50ms apart, far more than the few ms the delivery
+#thread and select can add, so their RTTs have to come out in order and each nearer its own hop than the next
+def testTracePath():
+    route = ("192.168.0.1", "10.0.0.1", "10.1.0.1")
+    network = simnet.SimulatedNetwork({"10.9.9.9": simnet.SimulatedHost(0.2, route=route)}, seed=5)
+    hops = pinger.tracePath("10.9.9.9", maxHops=10, count=1, timeout=0.5, onRound=None, mode=network)
+    assert [hop.address for hop in hops] == list(route) + ["10.9.9.9"]
+    assert all(hop.stats.received == 1 for hop in hops)
+    means = [hop.stats.mean for hop in hops]
+    assert means == sorted(means)
+    assert all(expected <= mean < expected + 25 for mean, expected in zip(means, (50, 100, 150, 200)))
+
+
+#a host that always answers after the timeout: every reply turns up while ping() waits for the next probe,
+#and none of them may be taken for that probe's answer
+def testLateRepliesAreNotAnswers():
+    network = simnet.SimulatedNetwork({"10.0.0.9": simnet.SimulatedHost(0.15)})
+    stats = pinger.ping("10.0.0.9", timeout=0.1, interval=0.1, count=4, mode=network)
+    assert (stats.sent, stats.received) == (4, 0)
+
+
+#a socket with an endless flood of echo replies to somebody else's id queued on it
+class FloodSocket:
+    type = SOCK_RAW
+
+    def __init__(self):
+        self.readFd, self.writeFd = os.pipe()
+        os.write(self.writeFd, b"\0")
+        icmp = bytearray(struct.pack("!bbHHH", 0, 0, 0, 0xBEEF, 1) + bytes(8))
+        self.packet = bytes([0x45]) + bytes(7) + bytes([64]) + bytes(11) + icmp
+
+    def recvfrom_into(self, buffer, nbytes=0, flags=0):
+        buffer[:len(self.packet)] = self.packet
+        return len(self.packet), ("10.0.0.1", 0)
+
+    def fileno(self):
+        return self.readFd
+
+    def getsockopt(self, level, option):
+        return 0
+
+    def close(self):
+        os.close(self.readFd)
+        os.close(self.writeFd)
+
+
+#receiveOnePing has to give up at its timeout even when the socket never runs dry
+def testReceiveTimesOutUnderFlood():
+    flood = FloodSocket()
+    started = time.monotonic()
+    result = pinger.receiveOnePing(flood, 1, 0.1, "10.0.0.1")
+    flood.close()
+    assert result.status == pinger.Status.TIMEOUT
+    assert time.monotonic() - started < 0.5
+
+
+#ping_many logs every probe with the time it went out, not the time the log was written
+def testPingManyLogTimes():
+    import tempfile
+    network = simnet.SimulatedNetwork()
+    with tempfile.TemporaryDirectory() as directory:
+        log = pinger.ResultLog(os.path.join(directory, "results.log"))
+        started = time.time_ns()
+        pinger.ping_many(["10.0.0.1", "10.0.0.2"], count=3, interval=0.1, timeout=0.2, mode=network, log=log)
+        log.close()
+        records, hosts = pinger.readResultLog(log.path)
+        for record in records:
+            expected = started + (record["seq"] - 1) * 100000000
+            assert abs(int(record["time"]) - expected) < 30000000, (record["seq"], record["time"] - started)
+        del records
+
+
+#monitor logs the time each probe went out too, a timeout is not stamped timeout later and a reply not at
+#the time it came in. two hosts at 20 probes a second: probe k goes out k * 50ms after the start
+def testMonitorLogTimes():
+    import tempfile
+    network = simnet.SimulatedNetwork({"10.0.0.1": simnet.SimulatedHost(0.08),
+                                       "10.0.0.2": simnet.SimulatedHost(loss=1.0)})
+    with tempfile.TemporaryDirectory() as directory:
+        log = pinger.ResultLog(os.path.join(directory, "results.log"))
+        started = time.time_ns()
+        pinger.monitor(["10.0.0.1", "10.0.0.2"], interval=0.1, count=3, timeout=0.2, onReport=None,
+                       mode=network, log=log)
+        log.close()
+        records, hosts = pinger.readResultLog(log.path)
+        assert len(records) == 6
+        for record in records:
+            expected = started + ((record["seq"] - 1) * 2 + record["host"]) * 50000000
+            assert abs(int(record["time"]) - expected) < 30000000, (record["seq"], record["time"] - started)
+        del records
+
+
+#a monitor run without reports, going on past a report being due
+def testMonitorWithoutReports():
+    network = simnet.SimulatedNetwork()
+    totals = pinger.monitor(["10.0.0.1"], interval=0.05, count=4, timeout=0.2, reportEvery=0.05, onReport=None,
+                            mode=network)
+    assert (totals["10.0.0.1"].sent, totals["10.0.0.1"].received) == (4, 4)
+
+
+#a SimulatedNetwork that keeps the sockets it handed out, to see they get closed
+class RecordingNetwork(simnet.SimulatedNetwork):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sockets = []
+
+    def socket(self):
+        mySocket = super().socket()
+        self.sockets.append(mySocket)
+        return mySocket
+
+
+#sweep a /24 where only a few addresses are alive: exactly those come out, each once, also when every
+#reply turns up twice. and a sweep that is given up on after the first host still closes its socket
+def testSweep():
+    live = ["192.0.2.1", "192.0.2.77", "192.0.2.254"]
+    for duplicate in (0.0, 1.0):
+        network = RecordingNetwork({address: simnet.SimulatedHost(duplicate=duplicate) for address in live},
+                                   simnet.SimulatedHost(loss=1.0))
+        found = [address for address, rtt in pinger.sweep(["192.0.2.0/24"], timeout=0.2, mode=network)]
+        assert sorted(found) == sorted(live)
+        assert network.sent == 254 and network.duplicated == (3 if duplicate else 0)
+        assert network.sockets[0].closed
+
+    network = RecordingNetwork({address: simnet.SimulatedHost() for address in live}, simnet.SimulatedHost(loss=1.0))
+    sweep = pinger.sweep(["192.0.2.0/24"], timeout=0.2, mode=network)
+    assert next(sweep)[0] in live
+    del sweep
+    assert network.sockets[0].closed
+
+
+#ping_sharded takes a simulated network like everything else that takes a mode, with the kernel filter on
+def testShardedSimulatedNetwork():
+    network = simnet.SimulatedNetwork({"10.0.0.3": simnet.SimulatedHost(loss=1.0)})
+    hosts = [f"10.0.0.{i}" for i in range(1, 21)]
+    stats = pinger.PingStats()
+    results = pinger.ping_sharded(hosts, count=2, interval=0.05, timeout=0.3, workers=3, stats=stats, mode=network)
+    answered = [result.status == pinger.Status.REPLY for host in hosts for result in results[host]]
+    assert answered == [host != "10.0.0.3" for host in hosts for round in range(2)]
+    assert (stats.sent, stats.received) == (40, 38)
+
+
+#on a dgram socket the sequence number is shared by every probe on the socket: when it wraps round onto
+#a probe that is still waiting the send has to be refused, not take the waiting probe's key over
+def testDgramSequenceWrap():
+    engine = pinger.PingEngine(["10.0.0.1"], timeout=1, mode=simnet.SimulatedNetwork())
+    try:
+        #pretend the kernel gave the socket id 5, the way a dgram socket works
+        engine.kernelID = 5
+        engine.probeSeq = 0xFFFF
+        waiting = engine.send(0, 0, 1)
+        assert engine.table.get((5, 0)) is waiting
+        engine.probeSeq = 0xFFFF
+        assert engine.send(0, 1, 2) is None
+        assert engine.table.get((5, 0)) is waiting and engine.probeSeq == 0xFFFF
+    finally:
+        engine.close()
+
+
+#ping() past sequence number 65535: the number on the wire wraps round to 0 and the replies still match
+def testPingSequenceWrap():
+    network = simnet.SimulatedNetwork()
+    #start the rounds just short of the wrap instead of sending 65536 probes first,
+    #ping()'s is the only range() with a start, the drain loops count from 0
+    def nearWrap(*bounds):
+        return range(*bounds) if len(bounds) == 1 else range(0xFFFE, 0xFFFE + bounds[1] - bounds[0])
+    pinger.range = nearWrap
+    try:
+        stats = pinger.ping("10.0.0.1", timeout=0.2, interval=0.01, count=4, mode=network)
+    finally:
+        del pinger.range
+    assert (stats.sent, stats.received) == (4, 4)
+
+
+#an AsyncPinger probe with a sequence number past 65535 goes out and is matched as the 16 bit number on the wire
+def testAsyncSequenceWrap():
+    import asyncio
+
+    async def probe():
+        asyncPinger = pinger.AsyncPinger(simnet.SimulatedNetwork())
+        try:
+            template = pinger.PacketTemplate("10.0.0.1", 7)
+            return await asyncPinger.probe(template, 7, 0x10001, 0.5)
+        finally:
+            asyncPinger.close()
+
+    assert asyncio.run(probe()).status == pinger.Status.REPLY
+
+
+#ping_many with metrics on, over a network where one of three hosts is dead: the counters add up, every
+#counter and stage goes through the hook, and prometheus() has a quantile line per percentile and stage
+def testMetrics():
+    collected = pinger.enableMetrics()
+    calls = []
+    collected.addHook(lambda name, value: calls.append((name, value)))
+    try:
+        network = simnet.SimulatedNetwork({"10.0.0.2": simnet.SimulatedHost(loss=1.0)})
+        pinger.ping_many(["10.0.0.1", "10.0.0.2", "10.0.0.3"], count=2, interval=0.05, timeout=0.2, mode=network)
+    finally:
+        pinger.disableMetrics()
+    assert pinger.metrics is None
+    counters = collected.counters
+    assert (counters["probes_sent"], counters["replies"], counters["timeouts"]) == (6, 4, 2)
+    for name, value in counters.items():
+        assert sum(n for called, n in calls if called == name) == value
+    assert {"socket", "checksum", "send", "select", "parse"} <= set(collected.timings)
+    for stage, histogram in collected.timings.items():
+        assert sum(1 for called, ms in calls if called == stage) == histogram.count
+
+    lines = collected.prometheus().splitlines()
+    assert "pinger_probes_sent_total 6" in lines and "pinger_timeouts_total 2" in lines
+    for stage in collected.timings:
+        quantiles = [line for line in lines if line.startswith(f'pinger_stage_seconds{{stage="{stage}",quantile=')]
+        assert [line.split('quantile="')[1].split('"')[0] for line in quantiles] == ["0.5", "0.9", "0.99", "0.999"]
+        values = [float(line.split()[1]) for line in quantiles]
+        assert values == sorted(values) and values[0] > 0
+        assert f'pinger_stage_seconds_count{{stage="{stage}"}} {collected.timings[stage].count}' in lines